@@ -0,0 +1,213 @@
+""" Benchmarks for the timetracking summarizer.
+
+Generates a synthetic timetracking journal (in the format of
+`examples/example_timetrack_day.txt`) and times the main code paths. The
+results can be saved as a baseline and later runs compared against it:
+
+    python benchmark.py --days 2000 --save baseline.json
+    python benchmark.py --days 2000 --compare baseline.json
+"""
+from datetime import date, timedelta
+from time import perf_counter
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tracemalloc
+
+import lineparser
+import recordfilter
+import tagcount
+import validation
+from timetracking_snakey_plotter import build_snakey_data
+
+_weekdays = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+_noise = ["Break", "Lunch", "Break to clean up files", ""]
+
+def generate_journal(days=365, entries_per_day=12, n_tags=60, n_cats=8,
+                     cats_per_line=3, all_ratio=0.02, and_ratio=0.1,
+                     noise_ratio=0.15, seed=0):
+    """ Generates the lines of a synthetic timetracking journal.
+
+    Parameters
+    ----------
+    days : `int`
+       The number of days (date lines) in the journal.
+    entries_per_day : `int`
+       The average number of timelog lines per day.
+    n_tags : `int`
+       The size of the activity and specifier tag vocabulary.
+    n_cats : `int`
+       The number of distinct categories.
+    cats_per_line : `int`
+       The maximum number of categories per line.
+    all_ratio : `float`
+       The share of the lines that use the special `@ALL` category.
+    and_ratio : `float`
+       The share of the lines with an additional "and @Tag" activity.
+    noise_ratio : `float`
+       The share of the lines that are not timelog lines (e.g., "Break").
+    seed : `int`
+       The seed for the random number generator.
+    """
+    rnd = random.Random(seed)
+    tags = ["@Tag%d"%i for i in range(n_tags)]
+    cats = ["@CAT%d"%i for i in range(n_cats)]
+    day = date(2020, 1, 1)
+    for _ in range(days):
+        yield "*%s %d.%d.%d*\n"%(_weekdays[day.weekday()],
+                                 day.day, day.month, day.year)
+        minute = 8*60
+        for _ in range(max(0, int(rnd.gauss(entries_per_day, 2)))):
+            if rnd.random()<noise_ratio:
+                yield rnd.choice(_noise)+"\n"
+                minute += 10
+            duration = rnd.choice([5, 10, 15, 20, 30, 45, 60, 90])
+            if minute+duration>=24*60:
+                break
+            activity = rnd.choice(tags)
+            specifiers = " ".join(rnd.sample(tags, rnd.randint(0, 3)))
+            if rnd.random()<and_ratio:
+                specifiers += " and "+rnd.choice(tags)
+            if rnd.random()<all_ratio:
+                line_cats = "@ALL"
+            else:
+                line_cats = " + ".join(
+                    rnd.sample(cats, rnd.randint(1, cats_per_line)))
+            yield "%d:%02d-%d:%02d\t%s on %s ( %s )\n"%(
+                minute//60, minute%60,
+                (minute+duration)//60, (minute+duration)%60,
+                activity, specifiers, line_cats)
+            minute += duration
+        day += timedelta(days=1)
+
+def _summarize_also_tags(lines):
+    return lineparser.parse_and_summarize(lines, also_tags=True,
+                                          do_print=False)
+
+def _count_tags(lines):
+    return tagcount.count_blocks(["".join(lines)])
+
+def _filter_records(lines):
+    records = lineparser.RecordTable().parse(lines)
+    record_filter = recordfilter.compile_record_filter(
+        records, ["@Tag1"], ["@CAT2"])
+    return records.filter(record_filter,
+                          (lines[lineno-1] for lineno in records.linenos))
+
+def _snakey_data(lines):
+    return build_snakey_data(_summarize_also_tags(lines))
+
+benchmarks = {
+    'parse_and_summarize':
+        lambda lines: lineparser.parse_and_summarize(lines, do_print=False),
+    'parse_and_summarize_also_tags': _summarize_also_tags,
+    'filter_records': _filter_records,
+    'count_tags': _count_tags,
+    'snakey_data': _snakey_data,
+    'validate':
+        lambda lines: validation.validate_records(
+            lineparser.RecordTable().parse(lines), min_gap=30),
+}
+
+def run_benchmark(func, lines, repeat=3):
+    """ Returns the best throughput (lines per second) out of `repeat` runs
+    and the peak memory (bytes) of a separate traced run. """
+    best_time = float('inf')
+    for _ in range(repeat):
+        start = perf_counter()
+        func(lines)
+        best_time = min(best_time, perf_counter()-start)
+
+    tracemalloc.start()
+    func(lines)
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'lines_per_second': len(lines)/best_time,
+            'peak_memory': peak_memory}
+
+def measure_startup(repeat=5):
+    """ Returns the best wall-clock time (seconds) of running `main.py` in a
+    new interpreter on the small example journal, i.e., the cost of the
+    startup and the imports of a short query. """
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    command = [sys.executable, os.path.join(package_dir, "main.py"),
+               os.path.join(package_dir, "examples",
+                            "example_timetrack_day.txt"), "--no_cache"]
+    best_time = float('inf')
+    for _ in range(repeat):
+        start = perf_counter()
+        subprocess.run(command, stdout=subprocess.DEVNULL, check=True)
+        best_time = min(best_time, perf_counter()-start)
+    return {'seconds': best_time}
+
+def compare_to_baseline(results, baseline, tolerance):
+    """ Returns the names of the benchmarks that regressed by more than the
+    relative `tolerance` in throughput, in peak memory or in the startup
+    time. """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        base = baseline[name]
+        if 'seconds' in result:
+            if result['seconds']>base['seconds']*(1+tolerance):
+                regressions.append(name)
+        elif result['lines_per_second']<base['lines_per_second']*(1-tolerance):
+            regressions.append(name)
+        elif result['peak_memory']>base['peak_memory']*(1+tolerance):
+            regressions.append(name)
+    return regressions
+
+if __name__=='__main__':
+    argparser = argparse.ArgumentParser(description=
+        'Benchmarks the timetracking summarizer with a synthetic journal.')
+    argparser.add_argument("--days", type=int, default=365)
+    argparser.add_argument("--entries", type=int, default=12, help="Entries per day")
+    argparser.add_argument("--tags", type=int, default=60)
+    argparser.add_argument("--cats", type=int, default=8)
+    argparser.add_argument("--cats_per_line", type=int, default=3)
+    argparser.add_argument("--all_ratio", type=float, default=0.02)
+    argparser.add_argument("--and_ratio", type=float, default=0.1)
+    argparser.add_argument("--noise_ratio", type=float, default=0.15)
+    argparser.add_argument("--seed", type=int, default=0)
+    argparser.add_argument("--repeat", type=int, default=3)
+    argparser.add_argument("--only", action='append', choices=list(benchmarks)+['startup'], help="Run only this benchmark")
+    argparser.add_argument("--write", dest='write_journal', help="Only write the generated journal to this file")
+    argparser.add_argument("--save", dest='save_baseline', help="Save the results to this JSON file")
+    argparser.add_argument("--compare", dest='compare_baseline', help="Compare the results to this saved JSON file")
+    argparser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression")
+    args = argparser.parse_args()
+
+    lines = list(generate_journal(args.days, args.entries, args.tags,
+        args.cats, args.cats_per_line, args.all_ratio, args.and_ratio,
+        args.noise_ratio, args.seed))
+    if args.write_journal:
+        with open(args.write_journal, 'w') as f:
+            f.writelines(lines)
+        exit()
+
+    results = {}
+    for name, func in benchmarks.items():
+        if args.only and name not in args.only:
+            continue
+        results[name] = run_benchmark(func, lines, args.repeat)
+        print(f"{name:32s} {results[name]['lines_per_second']:12.0f} lines/s"
+              f" {results[name]['peak_memory']/2**20:8.1f} MiB")
+    if not args.only or 'startup' in args.only:
+        results['startup'] = measure_startup(max(args.repeat, 5))
+        print(f"{'startup':32s} {results['startup']['seconds']*1000:12.1f} ms")
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare_baseline:
+        with open(args.compare_baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(results, baseline, args.tolerance)
+        for name in regressions:
+            print("REGRESSION:", name)
+        exit(1 if regressions else 0)
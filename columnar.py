@@ -0,0 +1,213 @@
+from collections import defaultdict
+
+import numpy as np
+
+import lineparser
+
+
+class ColumnarRecords:
+    """ A columnar (NumPy) view of a `lineparser.RecordTable` for computing
+    the summaries with grouped sums.
+
+    The categories and the tags are interned to integer IDs and each record
+    is exploded to (record, category), (record, category, activity) and
+    (record, category, activity, specifier) rows, exactly as the loops in
+    `lineparser.summarize_records` would visit them. The totals are then
+    accumulated with `numpy.bincount`, which sums in the row order, so the
+    results are identical to the ones of the pure Python implementation.
+
+    The rows are built with array operations from the columns of the table
+    and only the distinct (cats, and_tags) signatures and tags are visited
+    in Python. The activity and specifier rows are built on the first
+    summary that needs them. Build this once to compute several summaries.
+
+    The `@ALL` replacement and the tag translation are applied when building
+    the columns, as they also affect how the tags are split to activities and
+    specifiers.
+    """
+    def __init__(self, records, all_tags_replacement=[],
+                 tag_translator=lambda tag:tag):
+        self.tag_ids = {}
+        self.tag_names = []
+        self.all_tags_replacement = list(all_tags_replacement)
+        self.tag_translator = tag_translator
+        self.records = records
+
+        as_np = lambda a: np.frombuffer(a, dtype=a.typecode).astype(np.int64)
+        self.n_records = len(records)
+        self.durations = as_np(records.ends)-as_np(records.starts)
+        self.sig = as_np(records.sig_ids)
+
+        # The categories of each signature with the @ALL replaced
+        self.sig_cats = [lineparser.replace_all_tag(cats,
+                                                    self.all_tags_replacement)
+                         for cats, _ in records.signatures]
+        sig_cat_ids, sig_cat_starts = _flattened(
+            [[self._intern(cat) for cat in cats] for cats in self.sig_cats])
+        self.n_cats = np.diff(sig_cat_starts)[self.sig]
+        self.c_rec, pos = _exploded(self.n_cats)
+        self.c_cat = sig_cat_ids[sig_cat_starts[self.sig[self.c_rec]]+pos]
+        self._sig_cat_ids, self._sig_cat_starts = sig_cat_ids, sig_cat_starts
+        self.a_rec = None
+
+    def _intern(self, tag):
+        if tag not in self.tag_ids:
+            self.tag_ids[tag] = len(self.tag_names)
+            self.tag_names.append(tag)
+        return self.tag_ids[tag]
+
+    def _explode_tags(self):
+        """ Helper to split the tags of the records like `summarize_records`
+        does and to produce the activity and specifier ID rows. """
+        records, sig, n_records = self.records, self.sig, self.n_records
+        as_np = lambda a: np.frombuffer(a, dtype=a.typecode).astype(np.int64)
+
+        # The (translated) ID of each distinct tag of the table
+        raw_tags = list(records.tags)
+        translated = np.array([self._intern(self.tag_translator(tag))
+                               for tag in raw_tags]+[0], dtype=np.int64)
+        # The "and @Tags" of each signature that are not its categories
+        sig_and_ids, sig_and_starts = _flattened(
+            [[self._intern(self.tag_translator(tag))
+              for tag in and_tags if tag not in cats]
+             for cats, (_, and_tags) in zip(self.sig_cats,
+                                            records.signatures)])
+        V = len(self.tag_names)
+
+        # Leave out the tags that are categories of their record
+        tag_ends = as_np(records.tag_ends)
+        tag_rec = np.repeat(np.arange(n_records),
+                            np.diff(tag_ends, prepend=0))
+        raw = as_np(records.tag_ids)
+        T = len(raw_tags)
+        raw_ids = records.tags
+        cat_keys = np.array([s*T+raw_ids[cat]
+                             for s, cats in enumerate(self.sig_cats)
+                             for cat in cats if cat in raw_ids],
+                            dtype=np.int64)
+        kept = ~np.isin(sig[tag_rec]*T+raw, cat_keys)
+        tag_rec, tag = tag_rec[kept], translated[raw[kept]]
+
+        # The first tag is the activity (with the "and @Tags"), the rest
+        #  are the specifiers unless they are also "and @Tags"
+        is_first = np.ones(len(tag_rec), dtype=bool)
+        is_first[1:] = tag_rec[1:]!=tag_rec[:-1]
+        has_act = np.zeros(n_records, dtype=bool)
+        has_act[tag_rec[is_first]] = True
+        first_act = np.zeros(n_records, dtype=np.int64)
+        first_act[tag_rec[is_first]] = tag[is_first]
+        and_keys = np.array([s*V+and_id for s in range(len(sig_and_starts)-1)
+                             for and_id in sig_and_ids[sig_and_starts[s]:
+                                                       sig_and_starts[s+1]]],
+                            dtype=np.int64)
+        is_spc = ~is_first & ~np.isin(sig[tag_rec]*V+tag, and_keys)
+        spc_rec, spc = tag_rec[is_spc], tag[is_spc]
+
+        self.n_acts = has_act*(1+np.diff(sig_and_starts)[sig])
+        self.n_spcs = np.bincount(spc_rec, minlength=n_records)
+        cat_starts = self._sig_cat_starts[sig]
+        and_ids = np.append(sig_and_ids, 0)
+        and_starts = sig_and_starts[sig]
+        spc_starts = np.cumsum(self.n_spcs)-self.n_spcs
+
+        # for cat in cats: for act in activity_tags
+        self.a_rec, pos = _exploded(self.n_cats*self.n_acts)
+        n_a = self.n_acts[self.a_rec]
+        self.a_cat = self._sig_cat_ids[cat_starts[self.a_rec]+pos//n_a]
+        act_pos = pos%n_a
+        self.a_act = np.where(act_pos==0, first_act[self.a_rec],
+            and_ids[and_starts[self.a_rec]+np.maximum(act_pos-1, 0)])
+
+        # ... and for specifier in specifier_tags
+        self.s_rec, pos = _exploded(self.n_cats*self.n_acts*self.n_spcs)
+        n_a, n_s = self.n_acts[self.s_rec], self.n_spcs[self.s_rec]
+        self.s_cat = self._sig_cat_ids[cat_starts[self.s_rec]+pos//(n_a*n_s)]
+        act_pos = pos//n_s%n_a
+        self.s_act = np.where(act_pos==0, first_act[self.s_rec],
+            and_ids[and_starts[self.s_rec]+np.maximum(act_pos-1, 0)])
+        self.s_spc = spc[spc_starts[self.s_rec]+pos%n_s]
+
+    def summarize(self, only_cat=None, duration_scaler=1.0, also_tags=False):
+        """ Computes the same summary as `lineparser.summarize_records`. See
+        `lineparser.parse_and_summarize` for the parameters and the returned
+        value. """
+        td_min = self.durations.astype(np.float64)*duration_scaler
+        only_id = self.tag_ids.get(only_cat, -1) if only_cat else None
+
+        c_mask = slice(None) if only_id is None else self.c_cat==only_id
+        c_cat = self.c_cat[c_mask]
+        c_rec = self.c_rec[c_mask]
+        cat_ids, cat_mins = _grouped_sum(c_cat,
+            td_min[c_rec]/self.n_cats[c_rec])
+
+        total_per_cat = {}
+        for cat_id, minutes in zip(cat_ids.tolist(), cat_mins.tolist()):
+            cat = self.tag_names[cat_id]
+            total_per_cat[cat] = minutes if not also_tags else [minutes, {}]
+        if not also_tags:
+            return total_per_cat
+
+        if self.a_rec is None:
+            self._explode_tags()
+        a_mask = slice(None) if only_id is None else self.a_cat==only_id
+        a_rec, a_cat, a_act = \
+            self.a_rec[a_mask], self.a_cat[a_mask], self.a_act[a_mask]
+        V = len(self.tag_names)
+        a_keys = a_cat*V+a_act
+        act_keys, act_mins = _grouped_sum(a_keys,
+            td_min[a_rec]/self.n_cats[a_rec]/self.n_acts[a_rec]*duration_scaler)
+        for key, minutes in zip(act_keys.tolist(), act_mins.tolist()):
+            cat, act = self.tag_names[key//V], self.tag_names[key%V]
+            total_per_cat[cat][1][act] = [minutes, defaultdict(int)]
+
+        s_mask = slice(None) if only_id is None else self.s_cat==only_id
+        s_rec, s_cat, s_act, s_spc = (self.s_rec[s_mask], self.s_cat[s_mask],
+                                      self.s_act[s_mask], self.s_spc[s_mask])
+        # The (category, activity) pairs are already grouped, use their index
+        #  to keep the combined keys small.
+        sorted_act_keys = np.sort(act_keys)
+        pair_idx = np.searchsorted(sorted_act_keys, s_cat*V+s_act)
+        spc_keys, spc_mins = _grouped_sum(pair_idx*V+s_spc,
+            td_min[s_rec]/self.n_cats[s_rec]/self.n_acts[s_rec]/
+            self.n_spcs[s_rec]*duration_scaler)
+        for key, minutes in zip(spc_keys.tolist(), spc_mins.tolist()):
+            act_key = int(sorted_act_keys[key//V])
+            cat, act = self.tag_names[act_key//V], self.tag_names[act_key%V]
+            total_per_cat[cat][1][act][1][self.tag_names[key%V]] = minutes
+        return total_per_cat
+
+def _flattened(lists):
+    """ Helper to concatenate the lists to an array. Returns the array and
+    the start offsets of the lists (with the end as the last one). """
+    lengths = [len(l) for l in lists]
+    starts = np.zeros(len(lists)+1, dtype=np.int64)
+    np.cumsum(lengths, out=starts[1:])
+    return np.array([v for l in lists for v in l], dtype=np.int64), starts
+
+def _exploded(lengths):
+    """ Helper to explode the records to `lengths` rows each. Returns the
+    record and the position within the record of each row. """
+    rows_rec = np.repeat(np.arange(len(lengths)), lengths)
+    starts = np.cumsum(lengths)-lengths
+    return rows_rec, np.arange(len(rows_rec))-starts[rows_rec]
+
+def _grouped_sum(keys, weights):
+    """ Sums the weights by the keys in the order of the rows. Returns the
+    keys in the order of their first appearance and the sums. """
+    if len(keys)==0:
+        return keys, weights
+    unique_keys, first_idx, inverse = np.unique(keys, return_index=True,
+                                                return_inverse=True)
+    sums = np.bincount(inverse.ravel(), weights, minlength=len(unique_keys))
+    order = np.argsort(first_idx, kind='stable')
+    return unique_keys[order], sums[order]
+
+def summarize_records(records, only_cat=None, duration_scaler=1.0,
+                      also_tags=False,
+                      all_tags_replacement=[],
+                      tag_translator=lambda tag:tag):
+    """ A NumPy backed drop-in for `lineparser.summarize_records` (without
+    the printing). """
+    return ColumnarRecords(records, all_tags_replacement,
+                           tag_translator).summarize(
+        only_cat, duration_scaler, also_tags)
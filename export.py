@@ -0,0 +1,107 @@
+from collections import namedtuple
+
+import lineparser
+
+# One timelog line. The `start` and `end` are minutes from the midnight and
+#  the tag fields are space separated (translated) tags.
+RecordRow = namedtuple("RecordRow",
+    "date start end minutes cats activities specifiers source lineno")
+
+# One row of the totals. The total of a category has no `activity`, and the
+#  total of an activity has no `specifier`.
+SummaryRow = namedtuple("SummaryRow", "cat activity specifier minutes")
+
+# The column types of the rows (for the typed formats, e.g., Parquet)
+column_types = {
+    'date':str, 'start':int, 'end':int, 'minutes':float, 'cats':str,
+    'activities':str, 'specifiers':str, 'source':str, 'lineno':int,
+    'cat':str, 'activity':str, 'specifier':str,
+}
+
+def record_rows(records, only_cat=None, all_tags_replacement=[],
+                tag_translator=lambda tag:tag):
+    """ Generates a `RecordRow` per record of a `lineparser.RecordTable`.
+    With `only_cat` only the records with that category are included. The
+    tags are split against the categories of the line, so that the @ALL is
+    not taken for a specifier, and only the `cats` have the @ALL replaced.
+    """
+    day_dates = records.day_dates()
+    for rec in records:
+        cats = lineparser.replace_all_tag(rec.cats, all_tags_replacement)
+        if only_cat and only_cat not in cats:
+            continue
+        activity_tags, specifier_tags = lineparser.split_tags(
+            rec.cats, rec.tags, rec.and_tags, tag_translator)
+        day = day_dates[rec.day]
+        yield RecordRow(day.isoformat() if day else None,
+                        rec.start, rec.end, float(rec.end-rec.start),
+                        " ".join(cats), " ".join(activity_tags),
+                        " ".join(specifier_tags), rec.source, rec.lineno)
+
+def summary_rows(total_per_cat, with_specifiers=True):
+    """ Generates the `SummaryRow` views of the totals returned by
+    `lineparser.summarize_records`, sorted by the category, the activity and
+    the specifier. Each category comes before its activities, and each
+    activity before its specifiers (which are left out if not
+    `with_specifiers`). """
+    for cat, cat_data in sorted(total_per_cat.items()):
+        if not isinstance(cat_data, list):
+            yield SummaryRow(cat, None, None, cat_data)
+            continue
+        cat_minutes, activities = cat_data
+        yield SummaryRow(cat, None, None, cat_minutes)
+        for act, (act_minutes, specifiers) in sorted(activities.items()):
+            yield SummaryRow(cat, act, None, act_minutes)
+            if with_specifiers:
+                for spec, spec_minutes in sorted(specifiers.items()):
+                    yield SummaryRow(cat, act, spec, spec_minutes)
+
+def write_csv(rows, f, fields):
+    import csv
+    writer = csv.writer(f)
+    writer.writerow(fields)
+    writer.writerows(rows)
+
+def write_jsonl(rows, f, fields):
+    import json
+    for row in rows:
+        f.write(json.dumps(dict(zip(fields, row)))+"\n")
+
+def write_parquet(rows, path, fields, batch_size=65536):
+    """ Writes the rows to a Parquet file in batches of `batch_size` rows,
+    so that only one batch is held in the memory. Needs `pyarrow`. """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    arrow_types = {str:pa.string(), int:pa.int64(), float:pa.float64()}
+    schema = pa.schema([(field, arrow_types[column_types[field]])
+                        for field in fields])
+    with pq.ParquetWriter(path, schema) as writer:
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch)>=batch_size:
+                writer.write_batch(_to_batch(batch, schema))
+                batch = []
+        if batch:
+            writer.write_batch(_to_batch(batch, schema))
+
+def _to_batch(batch, schema):
+    import pyarrow as pa
+    return pa.RecordBatch.from_arrays(
+        [pa.array(column, type=field.type)
+         for column, field in zip(zip(*batch), schema)], schema=schema)
+
+def export_rows(rows, fields, path):
+    """ Streams the rows to the `path` as CSV, JSON lines or Parquet
+    depending on its extension (``.csv``, ``.jsonl`` or ``.parquet``). """
+    if path.endswith(".parquet"):
+        write_parquet(rows, path, fields)
+    elif path.endswith(".jsonl"):
+        with open(path, 'w', encoding='utf-8') as f:
+            write_jsonl(rows, f, fields)
+    elif path.endswith(".csv"):
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            write_csv(rows, f, fields)
+    else:
+        raise ValueError("Unknown export format: "+path)
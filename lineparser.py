@@ -1,12 +1,17 @@
-from math import floor
-from datetime import datetime, timedelta
-from collections import defaultdict
+from datetime import date
+from collections import defaultdict, namedtuple
+from itertools import repeat
+from array import array
+from sys import intern
+from functools import lru_cache
 import re
 
+import runstats
 
-# TODO: modify to use categories for the year, month, day
+
+# e.g., "Tue 04.01.2022", see `parse_date` for the calendar date
 date_re = re.compile(
-    r"(Mon|Tue|Wed|Thu|Fri|Sat|Sun|Mo|Tu|We|Th|Fr|Sa|Su) +([0-3]?[0-9])\.([01]?[0-9])\.([1|2]?[0-9]?[0-9][0-9])"
+    r"(?P<weekday>Mon|Tue|Wed|Thu|Fri|Sat|Sun|Mo|Tu|We|Th|Fr|Sa|Su) +(?P<day>[0-3]?[0-9])\.(?P<month>[01]?[0-9])\.(?P<year>[1|2]?[0-9]?[0-9][0-9])"
 )
 line_re = re.compile(
     r"(?P<from_hour>[0-9]{1,2})[:\.](?P<from_min>[0-9]{2})"+ # e.g., 9:30
@@ -30,19 +35,451 @@ def is_timelog_line(line):
 def is_date_line(line):
     return True if date_re.match(line.strip('*_ ')) else False
 
-def get_categories_from(line):
+def parse_date(line):
+    """ Returns the `datetime.date` of a date line, or `None` if the line is
+    not a (valid) date line. Two digit years are taken to be 2000s. """
+    mo = date_re.match(line.strip('*_ '))
+    if not mo:
+        return None
+    day, month, year = map(int, mo.group('day', 'month', 'year'))
+    if year<100:
+        year += 2000
+    try:
+        return date(year, month, day)
+    except ValueError:
+        return None
+
+cat_split_re = re.compile( r'/|\+| |, ' ) # separators of the categories
+
+# The same match as `line_re`, but only the times are captured
+_span_re = re.compile(
+    r"([0-9]{1,2})[:\.]([0-9]{2})\s*-\s*([0-9]{1,2})[:\.]([0-9]{2}),?\s+[^\(]")
+# The same as `date_re`, but also skips the '*_ ' decorations of the line
+_date_line_re = re.compile( r"[*_ ]*"+date_re.pattern )
+# The characters a date line may start with
+_date_line_starts = frozenset("*_ MTWFS")
+
+@lru_cache(maxsize=4096)
+def _categories_in(cats_text):
+    """ Helper to split the text in the parenthesis to categories. The
+    categories repeat a lot, hence the caching. """
+    return tuple(intern(c.strip())
+            for c in cat_split_re.split(cats_text)
+            if tag_re.match(c.strip()))
+
+def _categories_of(line):
     start_cats = line.rfind("(")
     end_cats = line.rfind(")")
-    cats = []
     if (start_cats!=-1 and end_cats!=-1):
-        cats = [c.strip() 
-            for c in re.split(r'/|\+| |, ', line[start_cats+1:end_cats])
-            if tag_re.match(c.strip())]
-    return cats
+        return _categories_in(line[start_cats+1:end_cats])
+    return ()
+
+def get_categories_from(line):
+    return list(_categories_of(line))
+
+DATE_LINE, TIMELOG_LINE = 1, 2
+
+def tokenize_line(line):
+    """ Classifies the line and extracts its parts with a single regex match
+    and a single tag scan (unless there is an "and @Tag" on the line).
+
+    Returns `None` for lines with no timelog data, ``(DATE_LINE,)`` for the
+    date lines and for the timelog lines a tuple
+    ``(TIMELOG_LINE, start, end, cats, tags, and_tags)``, where the `start`
+    and `end` are minutes from the midnight and the rest are tuples of the
+    tag strings as `get_categories_from`, `tag_re` and `and_tag_re` would
+    give them.
+    """
+    first = line[:1]
+    if '0'<=first<='9':
+        mo = _span_re.match(line)
+        if not mo:
+            return None
+        from_hour, from_min, to_hour, to_min = mo.groups()
+        # Most lines have no "and @Tag", so skip that scan
+        and_tags = (tuple(and_tag_re.findall(line))
+                    if "and @" in line else ())
+        return (TIMELOG_LINE,
+            _to_minutes(from_hour, from_min), _to_minutes(to_hour, to_min),
+            _categories_of(line), tuple(tag_re.findall(line)), and_tags)
+    if first in _date_line_starts and _date_line_re.match(line):
+        return (DATE_LINE,)
+    return None
 
 def flatten(t):
     return [item for sublist in t for item in sublist]
 
+# One parsed timelog line. `day` indexes `RecordTable.date_lines` (and the
+#  calendar dates in `RecordTable.dates`), `start` and `end` are minutes from
+#  midnight, `cats` the categories in the parenthesis, and `tags`/`and_tags`
+#  all the (untranslated) @Tags found on the line. The line itself is not
+#  kept, see `linereader.record_lines` to read it again.
+Record = namedtuple("Record", "day start end cats tags and_tags source lineno")
+
+_new_record = tuple.__new__
+
+# The per record columns of a `RecordTable` and their `array` type codes
+_columns = (('days', 'i'), ('starts', 'h'), ('ends', 'h'), ('sig_ids', 'i'),
+            ('tag_ends', 'i'), ('source_ids', 'i'), ('linenos', 'i'))
+
+class _Ids(dict):
+    """ Helper to number the distinct values in the order they are added. """
+    def __missing__(self, value):
+        self[value] = value_id = len(self)
+        return value_id
+
+def _remapped(ids, values, to_ids):
+    """ Helper to map the `ids` of the `values` to the ids of `to_ids`. """
+    id_map = [to_ids[value] for value in values]
+    if id_map==list(range(len(id_map))):
+        return ids
+    return map(id_map.__getitem__, ids)
+
+class RecordTable:
+    """ A table of timetracking records parsed from the lines exactly once.
+
+    The date lines are stored in `date_lines`, their `datetime.date` in
+    `dates`, and each record refers to its date section by index. The first
+    section (index 0) is reserved for the records that precede any date
+    line, and its date (as of any invalid date) is `None`. All the summaries
+    are computed from this table, see `summarize_records`.
+
+    The records are stored column-wise to `array`s of integers: the
+    (cats, and_tags) of a record index the distinct `signatures`, its tags
+    are the ids of the distinct `tags` in `tag_ids` up to its `tag_ends`,
+    and its source indexes the `sources`. Thus, the table takes a few dozen
+    bytes per record and has no objects for the garbage collector to track.
+    Iterating the table generates the `Record`s.
+    """
+    def __init__(self):
+        self.date_lines = [""]
+        self.dates = [None]
+        self.n_lines = 0
+        self.signatures = _Ids()
+        self.tags = _Ids()
+        self.sources = _Ids()
+        self.tag_ids = array('i')
+        for name, typecode in _columns:
+            setattr(self, name, array(typecode))
+
+    def __len__(self):
+        return len(self.days)
+
+    def __iter__(self):
+        signatures, tags = list(self.signatures), list(self.tags)
+        sources, tag_ids = list(self.sources), self.tag_ids
+        first_tag = 0
+        for day, start, end, sig_id, tag_end, source_id, lineno in zip(
+                *(getattr(self, name) for name, _ in _columns)):
+            cats, and_tags = signatures[sig_id]
+            yield _new_record(Record, (day, start, end, cats,
+                tuple(map(tags.__getitem__, tag_ids[first_tag:tag_end])),
+                and_tags, sources[source_id], lineno))
+            first_tag = tag_end
+
+    def date(self, day):
+        return self.date_lines[day].strip('*_ \n')
+
+    def day_dates(self):
+        """ Returns the `datetime.date` (or `None`) of each date section. """
+        return self.dates
+
+    def _tokens(self, lines, first_lineno):
+        """ Helper to generate the (day, lineno, line, tokens) of the timelog
+        lines. The date lines are added to the date sections on the way. """
+        day = len(self.date_lines)-1
+        lineno = first_lineno-1
+        for lineno, line in enumerate(lines, first_lineno):
+            try:
+                tokens = tokenize_line(line)
+            except BaseException as e:
+                print( "Problem on line with content: ", line)
+                raise e
+            if tokens is None:
+                continue
+            if tokens[0]==DATE_LINE:
+                self.date_lines.append(line)
+                self.dates.append(parse_date(line))
+                day += 1
+                continue
+            yield day, lineno, line, tokens
+        self.n_lines += lineno-first_lineno+1
+
+    def parse(self, lines, source="", first_lineno=1):
+        """ Parse the lines and append the resulting records to this table.
+
+        Lines before the first date line continue the last date section of
+        the table, just as if the lines were concatenated to the earlier ones.
+        """
+        source_id = self.sources[source]
+        signatures, tag_id, tag_ids = \
+            self.signatures, self.tags.__getitem__, self.tag_ids
+        add_day, add_start, add_end, add_sig_id, add_tag_end, \
+            add_source_id, add_lineno = (getattr(self, name).append
+                                         for name, _ in _columns)
+        for day, lineno, line, tokens in self._tokens(lines, first_lineno):
+            _, start, end, cats, tags, and_tags = tokens
+            add_day(day)
+            add_start(start)
+            add_end(end)
+            add_sig_id(signatures[cats, and_tags])
+            tag_ids.extend(map(tag_id, tags))
+            add_tag_end(len(tag_ids))
+            add_source_id(source_id)
+            add_lineno(lineno)
+        return self
+
+    def iter_parse(self, lines, source="", first_lineno=1):
+        """ Parse the lines like `parse`, but generate the (`Record`, line)
+        pairs instead of appending the records to this table. Only the date
+        sections are added to the table, so the records can be summarized
+        as they are read (see `summarize_stream`). """
+        for day, lineno, line, tokens in self._tokens(lines, first_lineno):
+            yield _new_record(Record,
+                (day,)+tokens[1:]+(source, lineno)), line
+
+    def extend_sections(self, other):
+        """ Append the date sections (but not the records) of another table
+        to this one. Returns the offset to add to the days of the records of
+        the other table. """
+        day_offset = len(self.date_lines)-1
+        self.date_lines += other.date_lines[1:]
+        self.dates += other.dates[1:]
+        self.n_lines += other.n_lines
+        return day_offset
+
+    def extend(self, other):
+        """ Append the records of another table (e.g. parsed from the next
+        file) to this one. """
+        day_offset = self.extend_sections(other)
+        tag_offset = len(self.tag_ids)
+        self.days.extend(other.days if not day_offset else
+                         (day+day_offset for day in other.days))
+        self.starts.extend(other.starts)
+        self.ends.extend(other.ends)
+        self.sig_ids.extend(_remapped(other.sig_ids, other.signatures,
+                                      self.signatures))
+        self.tag_ids.extend(_remapped(other.tag_ids, other.tags, self.tags))
+        self.tag_ends.extend(other.tag_ends if not tag_offset else
+            (tag_end+tag_offset for tag_end in other.tag_ends))
+        self.source_ids.extend(_remapped(other.source_ids, other.sources,
+                                         self.sources))
+        self.linenos.extend(other.linenos)
+        return self
+
+    def subset(self, indices):
+        """ Returns a new table of the records at the `indices` (in
+        ascending order) of this table. It shares the date sections and the
+        distinct values with this one. """
+        subset = RecordTable()
+        subset.date_lines = self.date_lines
+        subset.dates = self.dates
+        subset.signatures = self.signatures
+        subset.tags = self.tags
+        subset.sources = self.sources
+        for name, typecode in _columns:
+            column = getattr(self, name)
+            setattr(subset, name,
+                    array(typecode, map(column.__getitem__, indices)))
+        tag_ids, tag_ends = self.tag_ids, self.tag_ends
+        for i, tag_end in enumerate(subset.tag_ends):
+            subset.tag_ids += tag_ids[tag_ends[indices[i]-1]
+                                      if indices[i] else 0:tag_end]
+            subset.tag_ends[i] = len(subset.tag_ids)
+        return subset
+
+    def filter(self, predicate, lines=None):
+        """ Returns a new table with only the records passing the predicate.
+        The predicate is called with the `Record` and its line, which is
+        `None` unless the `lines` of the records (see
+        `linereader.record_lines`) are given. """
+        pairs = zip(self, lines if lines is not None else repeat(None))
+        return self.subset([i for i, (rec, line) in enumerate(pairs)
+                            if predicate(rec, line)])
+
+    def set_source(self, source):
+        """ Sets the source of all the records, e.g., of a table parsed from
+        a file that was then renamed. """
+        self.sources = _Ids()
+        self.source_ids = array('i', [self.sources[source]])*len(self)
+
+    def categories(self):
+        """ Returns the set of all categories used in the records. """
+        signatures = list(self.signatures)
+        all_cats = set()
+        for sig_id in set(self.sig_ids):
+            all_cats.update(signatures[sig_id][0])
+        return all_cats
+
+    def lines(self, record_lines):
+        """ Generates the date lines and the given lines of the records (see
+        `linereader.record_lines`) in their original order. """
+        next_day = 1
+        for day, line in zip(self.days, record_lines):
+            while next_day<=day:
+                yield self.date_lines[next_day]
+                next_day += 1
+            yield line
+        yield from self.date_lines[next_day:]
+
+@lru_cache(maxsize=4096)
+def _to_minutes(hour, minute):
+    hour, minute = int(hour), int(minute)
+    if not 0<=hour<=23:
+        raise ValueError("hour must be in 0..23", hour)
+    if not 0<=minute<=59:
+        raise ValueError("minute must be in 0..59", minute)
+    return hour*60+minute
+
+def replace_all_tag(cats, all_tags_replacement):
+    """ Returns the categories as a list with the '@ALL' category replaced
+    by the given categories (if any). """
+    cats = list(cats)
+    if '@ALL' in cats and all_tags_replacement:
+        cats+=all_tags_replacement
+        cats.remove('@ALL')
+    return cats
+
+def split_tags(cats, tags, and_tags, tag_translator=lambda tag:tag):
+    """ Splits the tags of a record to activity and specifier tags.
+
+    The first non-category tag and the "and @Tag" tags are the activities,
+    the rest of the tags are the specifiers. Returns the (translated)
+    activity and specifier tag lists.
+    """
+    tags = [tag_translator(tag)
+            for tag in tags
+            if tag not in cats]
+    and_tags = [tag_translator(tag)
+                for tag in and_tags
+                if tag not in cats]
+
+    activity_tags = []
+    specifier_tags = []
+    if tags:
+        activity_tags = [tags[0]] + and_tags
+        specifier_tags = [tag for tag in tags[1:]
+                              if tag not in and_tags]
+        # Naively leave out prulars
+        #activity_tags = [t if t[-1]!='s' else t[:-1] for t in activity_tags]
+        #specifier_tags = [t if t[-1]!='s' else t[:-1] for t in specifier_tags]
+    return activity_tags, specifier_tags
+
+def parse_records(lines, source=""):
+    """ Parse the lines into a `RecordTable`. """
+    return RecordTable().parse(lines, source)
+
+def scan_categories(lines):
+    """ Returns the set of the categories on the timelog lines, the same as
+    `RecordTable.categories` of the parsed lines. Only the lines with a
+    category not seen before are tokenized, so this is much quicker than
+    parsing the lines. """
+    all_cats = set()
+    for line in lines:
+        cats = _categories_of(line)
+        if not cats or all_cats.issuperset(cats):
+            continue
+        try:
+            tokens = tokenize_line(line)
+        except ValueError:
+            continue # is reported when the line is parsed
+        if tokens and tokens[0]==TIMELOG_LINE:
+            all_cats.update(cats)
+    return all_cats
+
+def summarize_records(records, only_cat=None, duration_scaler=1.0,
+                      also_tags=False,
+                      all_tags_replacement=[],
+                      tag_translator=lambda tag:tag,
+                      do_print=True, min2str=lambda min:int(min),
+                      lines=None, stats=runstats.disabled):
+    """ Summarize the records of a `RecordTable`.
+
+    See `parse_and_summarize` for the parameters and the returned value. The
+    printed warnings and the notes of `only_cat` quote the `lines` of the
+    records (see `linereader.record_lines`), if given. Printing the daily
+    totals is timed as the 'print' stage of the `stats`.
+    """
+    return summarize_stream(
+        zip(records, lines if lines is not None else repeat("")), records,
+        only_cat, duration_scaler=duration_scaler, also_tags=also_tags,
+        all_tags_replacement=all_tags_replacement,
+        tag_translator=tag_translator, do_print=do_print, min2str=min2str,
+        stats=stats)
+
+def summarize_stream(pairs, records, only_cat=None, duration_scaler=1.0,
+                     also_tags=False,
+                     all_tags_replacement=[],
+                     tag_translator=lambda tag:tag,
+                     do_print=True, min2str=lambda min:int(min),
+                     stats=runstats.disabled):
+    """ Summarize the (`Record`, line) pairs as they come, e.g., from
+    `RecordTable.iter_parse`, without keeping them. The `records` is the
+    table with their date sections. See `summarize_records` for the rest.
+    """
+    daily_minutes, daily_cat_minutes, daily_notes = 0, 0, ""
+    prev_day, prev_time_to = 0, 0
+
+    total_per_cat = {}
+
+    def print_day(day):
+        if daily_minutes>0 and do_print:
+            with stats.stage('print'):
+                if only_cat:
+                    print(records.date(day), ":", min2str(daily_cat_minutes),
+                          ":", daily_notes.replace("@", ""), "\n")
+                else:
+                    print(records.date(day), ":", min2str(daily_minutes))
+
+    for rec, line in pairs:
+        if rec.day!=prev_day:
+            print_day(prev_day)
+            daily_minutes, daily_cat_minutes, daily_notes = 0, 0, ""
+            prev_day, prev_time_to = rec.day, 0
+
+        if rec.start<prev_time_to:
+            if do_print:
+                print("WARNING: Time overlap on", records.date(prev_day), "line:", line)
+        prev_time_to = rec.end
+
+        td_min = float(rec.end-rec.start)*duration_scaler
+        daily_minutes += td_min
+
+        cats = replace_all_tag(rec.cats, all_tags_replacement)
+
+        if not cats:
+            if do_print:
+                print("Warning, no categories on", records.date(prev_day), "line:", line)
+
+        if also_tags:
+            activity_tags, specifier_tags = split_tags(cats, rec.tags,
+                rec.and_tags, tag_translator)
+
+        for cat in cats:
+            if only_cat and only_cat!=cat:
+                continue # skip all but the tag
+            if not cat in total_per_cat:
+                total_per_cat[cat] = 0 if not also_tags else [0, {}]
+            daily_notes += line[:line.rfind("(")-1].strip("0123456789:.-\t ")+"; "
+
+            if also_tags:
+                total_per_cat[cat][0]+=td_min/len(cats)
+                if activity_tags:
+                    for activity_tag in activity_tags:
+                        if not activity_tag in total_per_cat[cat][1]:
+                            total_per_cat[cat][1][activity_tag] = [0, defaultdict(int)]
+                        total_per_cat[cat][1][activity_tag][0]+=td_min/len(cats)/len(activity_tags)*duration_scaler
+                        for s_tag in specifier_tags:
+                            total_per_cat[cat][1][activity_tag][1][s_tag] += td_min/len(cats)/len(activity_tags)/len(specifier_tags)*duration_scaler
+            else:
+                total_per_cat[cat]+=td_min/len(cats)
+
+            daily_cat_minutes+=td_min/len(cats)
+
+    print_day(prev_day)
+
+    return total_per_cat
+
 def parse_and_summarize(lines, only_cat=None, duration_scaler=1.0,
                         also_tags=False,
                         all_tags_replacement=[],
@@ -55,6 +492,10 @@ def parse_and_summarize(lines, only_cat=None, duration_scaler=1.0,
      * `line_re` specifies the format of a timetracking record line.
      * `tag_re` and `and_tag_re` are used to identify additional tags.
 
+    The records are summarized as they are parsed, see `summarize_stream`.
+    Parse the lines to a `RecordTable` with `parse_records` to compute
+    several summaries out of the same lines.
+
     Parameters
     ----------
     lines : `list`
@@ -78,101 +519,10 @@ def parse_and_summarize(lines, only_cat=None, duration_scaler=1.0,
     datastructure (see impl.) also_tags is enabled.
 
     """
-    daily_minutes, daily_cat_minutes, daily_notes = 0, 0, ""
-    prev_date, prev_time_to = "", datetime.fromtimestamp(0)
-    dummydt = datetime.now() # Not used, but need to be given to datetime
-
-    total_per_cat = {}
-    
-    for line in lines:
-        try:
-            if is_date_line(line):
-                #print("match do", line)
-                if daily_minutes>0 and do_print:
-                    if only_cat:
-                        print(prev_date, ":", min2str(daily_cat_minutes),
-                              ":", daily_notes.replace("@", ""), "\n")
-                    else:
-                        print(prev_date, ":", min2str(daily_minutes))
-
-                daily_minutes, daily_cat_minutes, daily_notes = 0, 0, ""
-                prev_date, prev_time_to = line.strip('*_ \n'), datetime.fromtimestamp(0)
-                continue
-
-            mo = line_re.match(line)
-            if mo:
-                from_dt = datetime(year=dummydt.year, month=dummydt.month, day=dummydt.day,
-                                hour=int(mo.group('from_hour')),
-                                minute=int(mo.group('from_min')))
-                to_dt   = datetime(year=dummydt.year, month=dummydt.month, day=dummydt.day,
-                                hour=int(mo.group('to_hour')),
-                                minute=int(mo.group('to_min')))
-
-                if from_dt<prev_time_to and do_print:
-                    print("WARNING: Time overlap on", prev_date, "line:", line)     
-                prev_time_to = to_dt
-
-                task_duration:timedelta = to_dt-from_dt
-                td_min = (task_duration.total_seconds())/60.0*duration_scaler
-                daily_minutes += td_min
-
-                cats = get_categories_from(line)
-                if '@ALL' in cats and all_tags_replacement:
-                    cats+=all_tags_replacement
-                    cats.remove('@ALL')
-                #print(cats, all_tags_replacement)
-                
-                if not cats and do_print:
-                    print("Warning, no categories on", prev_date, "line:", line)
-                
-                tags = []
-                if also_tags:
-                    tags = [tag_translator(tag)
-                            for tag in tag_re.findall(line)
-                            if tag not in cats]
-                    and_tags = [tag_translator(tag)
-                                for tag in and_tag_re.findall(line)
-                                if tag not in cats]
-
-                    activity_tags = []
-                    specifier_tags = []
-                    if tags:
-                        activity_tags = [tags[0]] + and_tags
-                        specifier_tags = [tag for tag in tags[1:]
-                                              if tag not in and_tags]
-                        # Naively leave out prulars
-                        #activity_tags = [t if t[-1]!='s' else t[:-1] for t in activity_tags]
-                        #specifier_tags = [t if t[-1]!='s' else t[:-1] for t in specifier_tags]
-
-                for cat in cats:
-                    if only_cat and only_cat!=cat:
-                        continue # skip all but the tag
-                    if not cat in total_per_cat:
-                        total_per_cat[cat] = 0 if not also_tags else [0, {}]
-                    daily_notes += line[:line.rfind("(")-1].strip("0123456789:.-\t ")+"; "
-
-                    if also_tags:
-                        total_per_cat[cat][0]+=td_min/len(cats) 
-                        if tags:
-                            for activity_tag in activity_tags:
-                                if not activity_tag in total_per_cat[cat][1]:
-                                    total_per_cat[cat][1][activity_tag] = [0, defaultdict(int)]
-                                total_per_cat[cat][1][activity_tag][0]+=td_min/len(cats)/len(activity_tags)*duration_scaler
-                                for s_tag in specifier_tags:
-                                    total_per_cat[cat][1][activity_tag][1][s_tag] += td_min/len(cats)/len(activity_tags)/len(specifier_tags)*duration_scaler
-                    else:
-                        total_per_cat[cat]+=td_min/len(cats)
-
-                    daily_cat_minutes+=td_min/len(cats)
-
-        except BaseException as e:
-            print( "Problem on line with content: ", line)
-            raise e
-                    
-    if daily_minutes>0 and do_print:
-        if only_cat:
-            print(prev_date, ":", min2str(daily_cat_minutes), ":", daily_notes.replace("@", ""), "\n")
-        else:
-            print(prev_date, ":", min2str(daily_minutes))
-
-    return total_per_cat
+    records = RecordTable()
+    return summarize_stream(records.iter_parse(lines), records, only_cat,
+        duration_scaler=duration_scaler,
+        also_tags=also_tags,
+        all_tags_replacement=all_tags_replacement,
+        tag_translator=tag_translator,
+        do_print=do_print, min2str=min2str)
@@ -0,0 +1,234 @@
+from glob import glob
+from collections import deque
+from contextlib import ExitStack, nullcontext
+from importlib import import_module
+import sys
+
+import lineparser
+import runstats
+
+# Compressed journals are opened transparently based on the file extension.
+#  The modules are imported only when needed to keep the startup fast.
+_openers = {
+    '.gz': 'gzip',
+    '.xz': 'lzma',
+    '.lzma': 'lzma',
+    '.bz2': 'bz2',
+}
+
+# The file name to read the standard input
+STDIN = "-"
+
+def expand_file_names(file_names):
+    """ Generates the file names, globbing if there are wildcards present. """
+    for fn in file_names:
+        if '*' in fn or '?' in fn:
+            yield from glob(fn)
+        else:
+            yield fn
+
+def is_compressed(file_name):
+    return any(file_name.endswith(ext) for ext in _openers)
+
+# The copy of the standard input, see `_open_stdin`
+_stdin_copy = None
+
+def _open_stdin():
+    """ Helper to copy the standard input to a temporary file when first
+    opened, so that it can be read again, e.g., by `record_lines`. """
+    global _stdin_copy
+    if _stdin_copy is None:
+        from shutil import copyfileobj
+        from tempfile import TemporaryFile
+        _stdin_copy = TemporaryFile('w+', encoding='utf-8', newline='')
+        copyfileobj(sys.stdin, _stdin_copy)
+    _stdin_copy.seek(0)
+    return nullcontext(_stdin_copy)
+
+def open_journal(file_name):
+    """ Opens a (possibly compressed) timetracking file for reading text.
+    The `STDIN` file name reads the standard input (which is left open), so
+    that, e.g., ``zcat`` or ``grep`` output can be piped in. """
+    if file_name==STDIN:
+        return _open_stdin()
+    for ext, module in _openers.items():
+        if file_name.endswith(ext):
+            return import_module(module).open(file_name, 'rt')
+    return open(file_name)
+
+def iter_files(file_names):
+    """ Generates (file_name, lines) pairs for the files. The lines are read
+    lazily, and each file is closed as soon as the next one is requested.
+    """
+    for fn in expand_file_names(file_names):
+        with open_journal(fn) as f:
+            yield fn, f
+
+def iter_lines(file_names):
+    """ Generates the lines of all the files one after another without
+    reading the files fully into memory. """
+    for _, lines in iter_files(file_names):
+        yield from lines
+
+def contains(file_names, text, block_size=1<<20):
+    """ Returns `True` if the text is in any of the files, which are read
+    in blocks of `block_size` characters. """
+    for fn in expand_file_names(file_names):
+        with open_journal(fn) as f:
+            tail = ""
+            for block in iter(lambda: f.read(block_size), ""):
+                if text in tail+block:
+                    return True
+                tail = block[-len(text)+1:]
+    return False
+
+def scan_categories(file_names):
+    """ Returns the set of the categories used in the files without parsing
+    them, see `lineparser.scan_categories`. """
+    return lineparser.scan_categories(iter_lines(file_names))
+
+def iter_records(file_names, records):
+    """ Generates the (`lineparser.Record`, line) pairs of the files as they
+    are parsed. Only the date sections are kept in the `records` table, see
+    `lineparser.RecordTable.iter_parse`. """
+    for fn, lines in iter_files(file_names):
+        yield from records.iter_parse(lines, fn)
+
+def record_lines(records):
+    """ Generates the lines of the records of a `lineparser.RecordTable` by
+    reading them again from their files, as the table does not keep them.
+    The files are read forward, so this is fast for the records in their
+    file order (as parsed). """
+    sources, source_id, lineno = list(records.sources), None, 0
+    with ExitStack() as opened:
+        for rec_source_id, rec_lineno in zip(records.source_ids,
+                                             records.linenos):
+            if rec_source_id!=source_id or rec_lineno<=lineno:
+                opened.close()
+                lines = opened.enter_context(
+                    open_journal(sources[rec_source_id]))
+                source_id, lineno = rec_source_id, 0
+            for _ in range(rec_lineno-lineno-1):
+                next(lines)
+            lineno = rec_lineno
+            yield next(lines)
+
+def iter_chunks(file_names, chunk_lines=20000):
+    """ Generates (file_name, first_lineno, lines) chunks of the files. The
+    files are split at date lines after at least `chunk_lines` lines. """
+    for fn, lines in iter_files(file_names):
+        chunk, first_lineno = [], 1
+        for lineno, line in enumerate(lines, 1):
+            if len(chunk)>=chunk_lines and lineparser.is_date_line(line):
+                yield fn, first_lineno, chunk
+                chunk, first_lineno = [], lineno
+            chunk.append(line)
+        if chunk or first_lineno==1:
+            yield fn, first_lineno, chunk
+
+def _parse_chunk(chunk):
+    source, first_lineno, lines = chunk
+    return source, first_lineno, lineparser.RecordTable().parse(
+        lines, source, first_lineno)
+
+def _parse_tables(file_names, jobs=1, stats=runstats.disabled):
+    """ Generates a (file_name, RecordTable) pair for each of the files.
+    With `jobs` > 1 the 'read' stage of the `stats` times the splitting of
+    the files to chunks and the 'parse' stage the waiting for the parsed
+    chunks and merging them. """
+    if jobs<=1:
+        for fn, f in iter_files(file_names):
+            yield fn, _parse_timed(fn, f, lineparser.RecordTable(), stats)
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(jobs) as executor:
+        # Keep only a bounded number of chunks in flight
+        pending = deque()
+        table_fn, table = None, None
+        def merge(future):
+            """ Returns the previous table if the future starts a new one.
+            """
+            nonlocal table_fn, table
+            with stats.stage('parse'):
+                fn, first_lineno, chunk_table = future.result()
+                if first_lineno!=1:
+                    table.extend(chunk_table)
+                    return None
+            done = (table_fn, table) if table is not None else None
+            table_fn, table = fn, chunk_table
+            return done
+
+        chunks = iter_chunks(file_names)
+        while True:
+            with stats.stage('read'):
+                chunk = next(chunks, None)
+            if chunk is None:
+                break
+            pending.append(executor.submit(_parse_chunk, chunk))
+            if len(pending)>=2*jobs:
+                done = merge(pending.popleft())
+                if done:
+                    yield done
+        while pending:
+            done = merge(pending.popleft())
+            if done:
+                yield done
+        if table is not None:
+            yield table_fn, table
+
+def _parse_timed(fn, f, records, stats):
+    """ Helper to parse the open file in blocks of lines to time the reading
+    and the parsing separately. """
+    if not stats.enabled:
+        return records.parse(f, fn)
+    lineno = 1
+    while True:
+        with stats.stage('read'):
+            lines = f.readlines(1<<20)
+        if not lines:
+            break
+        with stats.stage('parse'):
+            records.parse(lines, fn, lineno)
+        lineno += len(lines)
+    return records
+
+def parse_files(file_names, records=None, jobs=1, cache=None,
+                stats=runstats.disabled):
+    """ Streams the lines of the files into a `lineparser.RecordTable`.
+
+    With `jobs` > 1 the files are split to chunks (see `iter_chunks`) that
+    are parsed in a pool of processes. The partial tables are merged in the
+    input order, so the result is identical to the one of a serial run.
+    With a `parsecache.ParseCache` only the changed files are parsed. The
+    reading and the parsing are timed separately to the `stats`, and the
+    loading and the storing of the cache entries as the 'cache_load' and
+    'cache_store' stages.
+    """
+    if records is None:
+        records = lineparser.RecordTable()
+    if cache is None and jobs<=1:
+        for fn, f in iter_files(file_names):
+            _parse_timed(fn, f, records, stats)
+        return records
+    if cache is None:
+        for _, table in _parse_tables(file_names, jobs, stats):
+            with stats.stage('parse'):
+                records.extend(table)
+        return records
+
+    file_names = list(expand_file_names(file_names))
+    with stats.stage('cache_load'):
+        cached = {fn:None if fn==STDIN else cache.load(fn)
+                  for fn in set(file_names)}
+    parsed = dict(_parse_tables(
+        [fn for fn in file_names if cached[fn] is None], jobs, stats))
+    with stats.stage('cache_store'):
+        for fn, table in parsed.items():
+            if fn!=STDIN:
+                cache.store(fn, table)
+        cache.evict()
+    with stats.stage('parse'):
+        for fn in file_names:
+            records.extend(parsed[fn] if cached[fn] is None else cached[fn])
+    return records
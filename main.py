@@ -1,9 +1,14 @@
-from glob import glob
-from collections import Counter
+from datetime import date
 from math import floor
 import argparse
+import atexit
 
+# Only the modules needed by all the modes are imported up front, the rest
+#  are imported where used to keep the startup fast.
+import export
 import lineparser
+import linereader
+import runstats
 
 def min2str(total_minutes, in_part_hours=True):
     """Helper to convert minutes to hours (either to "2.50" or "2:30")."""
@@ -14,22 +19,20 @@ def min2str(total_minutes, in_part_hours=True):
         remaining_minutes = int(total_minutes-total_hours*60)
         return f"{total_hours}:{remaining_minutes:02d}"
 
-def _filter_lines(all_lines, line_incls, line_excls):
-    """Helper to do line filtering using include and exclude lists."""
-    filtered_lines = []
-    for l in all_lines:
-        if not lineparser.is_timelog_line(l):
-            if lineparser.is_date_line(l):
-                filtered_lines.append(l)
-            pass
-        elif line_incls and all( [(lf in l) for lf in line_incls] ):
-            if not line_excls or all( [(not lf in l) for lf in line_excls] ):
-                filtered_lines.append(l)
-        elif line_excls:
-            if all( [(not lf in l) for lf in line_excls] ):
-                filtered_lines.append(l)
-                
-    return filtered_lines
+def _filter_records(records, line_incls, line_excls, where=None):
+    """Helper to do record filtering using include and exclude lists and the
+    `recordfilter.parse_where` predicate terms."""
+    import recordfilter
+    lines = linereader.record_lines(records) if line_incls or line_excls \
+        else None
+    return records.filter(recordfilter.compile_record_filter(
+        records, line_incls, line_excls, where), lines)
+
+def _print_tag_counts(tag_counts, top=None, min_count=1, indent=""):
+    """Helper to print the tags and their counts from the most common on."""
+    import tagcount
+    for tag, tag_count in tagcount.most_common(tag_counts, top, min_count):
+        print(indent+str(tag_count), tag)
 
 if __name__=='__main__':
     argparser = argparse.ArgumentParser(description=
@@ -37,104 +40,287 @@ if __name__=='__main__':
         'Valid lines are of the format "12.03-13:52 @Did a lot ( @CAT )".\n'+
         'Where the "@CAT" is the project / job category and "@Did" is a tag.".\n'+
         'Remember that on Windows Ctrl+Z <ENTER> ends stdin input.' )
-    argparser.add_argument("file_name", nargs='+')
+    argparser.add_argument("file_name", nargs='*', default=[linereader.STDIN], help="The timesheet files, \"-\" (the default) reads stdin")
     argparser.add_argument("--cat", dest='cat', help="Only show this category/project")
     argparser.add_argument("--lnincl", dest='line_incls', action='append', help="Only consider records with this text")
     argparser.add_argument("--lnexcl", dest='line_excls', action='append', help="Only consider records with this text")
+    argparser.add_argument("--where", dest='where', action='append', help="Only consider records matching these terms, e.g. \"cat:@RES -tag:@Lunch date>=2022-03-01\"")
+    argparser.add_argument("--from", dest='date_from', type=date.fromisoformat, help="Only consider records from this date on (YYYY-MM-DD)")
+    argparser.add_argument("--to", dest='date_to', type=date.fromisoformat, help="Only consider records up to this date (YYYY-MM-DD)")
+    argparser.add_argument("--by", dest='by_period', choices=['day', 'week', 'month'], help="Show the totals per day, week or month")
     argparser.add_argument("--show_included", dest='show_included', action='store_true', help="Show included lines")
     argparser.add_argument("--s2m", dest='scale_to_mins', help="Scale minutes so that the total is this")
     argparser.add_argument("--snakey", dest='plot_snakey', action='store_true', help="Produce a snakey plot")
     argparser.add_argument("--no_snakey_specifiers", dest='no_snakey_specifiers', action='store_true', help="Hide specifiers from snakey plot")
+    argparser.add_argument("--snakey_top", dest='snakey_top', type=int, help="Merge all but this many largest nodes per level of the snakey plot to \"Other\"")
+    argparser.add_argument("--snakey_min_minutes", dest='snakey_min_minutes', type=float, default=0, help="Merge the nodes with less minutes to \"Other\" in the snakey plot")
+    argparser.add_argument("--snakey_output", dest='snakey_output', help="Write the snakey plot to this .html or .json file instead of showing it")
     argparser.add_argument("--activity", dest='by_activity', action='store_true', help="Show by activity")
     argparser.add_argument("--count_tags", dest='count_tags', action='store_true', help="Only show tags and their counts")
+    argparser.add_argument("--tags_top", dest='tags_top', type=int, help="With --count_tags, only show this many most common tags")
+    argparser.add_argument("--tags_min_count", dest='tags_min_count', type=int, default=1, help="With --count_tags, only show the tags counted at least this many times")
+    argparser.add_argument("--tags_by_cat", dest='tags_by_cat', action='store_true', help="With --count_tags, count the tags per category (and per --by period)")
+    argparser.add_argument("--validate", dest='validate', action='store_true', help="Only check all the records for overlaps, duplicates and negative spans, and print the issues as JSON")
+    argparser.add_argument("--min_gap", dest='min_gap', type=int, help="With --validate, also report the gaps of at least this many minutes within a day")
+    argparser.add_argument("--export", dest='export_file', help="Only write the rows to this .csv, .jsonl or .parquet file")
+    argparser.add_argument("--export_rows", dest='export_rows', choices=['records', 'activity', 'totals'], default='records', help="Export a row per record (default), per category, activity and specifier, or per category")
+    argparser.add_argument("--jobs", dest='jobs', type=int, default=1, help="Parse the files using this many processes")
+    argparser.add_argument("--backend", dest='backend', choices=['python', 'numpy'], default='python', help="Compute the --activity, --snakey and --s2m summaries with this backend")
+    argparser.add_argument("--no_cache", dest='no_cache', action='store_true', help="Do not use the cache of parsed files")
+    argparser.add_argument("--clear_cache", dest='clear_cache', action='store_true', help="Empty the cache of parsed files first")
+    argparser.add_argument("--cache_dir", dest='cache_dir', help="Where to keep the cache of parsed files")
+    argparser.add_argument("--watch", dest='watch', action='store_true', help="Keep following the files and print the totals when they change")
+    argparser.add_argument("--watch_interval", dest='watch_interval', type=float, default=1.0, help="Seconds between checking the files for changes")
+    argparser.add_argument("--watch_port", dest='watch_port', type=int, help="Serve the current totals as JSON on this localhost port")
+    argparser.add_argument("--stats", dest='stats', action='store_true', help="Print the stage timings and the counters as JSON to stderr")
+    argparser.add_argument("--profile", dest='profile_file', help="Write a cProfile of the run to this file (implies --stats)")
+    argparser.add_argument("--trace_memory", dest='trace_memory', action='store_true', help="Report the peak memory and the top allocations (implies --stats)")
     argparser.add_argument('--taf', dest='tag_alias_file', type=argparse.FileType('r'), help="A text file with each line containing some @ReadTag=@Alias rule")
+    argparser.add_argument('--taf_ignore_case', dest='taf_ignore_case', action='store_true', help="Match the @ReadTag of the --taf rules regardless of the case")
     args = argparser.parse_args()
-    
-    # read all lines from all files to this list
-    all_lines = [] 
-    for fn in args.file_name:
-        # Glob if there is wildcards present
-        if '*' in fn or '?' in fn:
-            for globbed_fn in glob(fn):
-                all_lines+=open(globbed_fn).readlines()
-        else:
-            all_lines+=open(fn).readlines()
-    if args.line_incls or args.line_excls:
-        all_lines = _filter_lines(all_lines, args.line_incls, args.line_excls)
-        if args.show_included:
-            for l in all_lines: print(l)
-            
 
-    tag_alias_rules = {}
+    stats = runstats.disabled
+    if args.stats or args.profile_file or args.trace_memory:
+        stats = runstats.Stats()
+        stats.start_profiling(args.profile_file, args.trace_memory)
+        atexit.register(stats.emit)
+    
+    tag_to_tag = lambda tag:tag
     if args.tag_alias_file:
-        for alias_line in args.tag_alias_file.readlines():
-            parts = alias_line.split(", =")
-            if len(parts)!=2: continue
-            from_tag, to_tag = parts
-            tag_alias_rules[from_tag] = to_tag
-    def tag_to_tag(tag):
-        return tag if tag not in tag_alias_rules else tag_alias_rules[tag]
+        import re
+        import tagalias
+        try:
+            tag_aliases = tagalias.TagAliases(
+                tagalias.parse_rules(args.tag_alias_file),
+                ignore_case=args.taf_ignore_case)
+        except (ValueError, re.error) as e:
+            argparser.error(str(e))
+        if tag_aliases:
+            tag_to_tag = tag_aliases.translate
+
+    in_date_range = args.date_from or args.date_to or args.by_period
+    if in_date_range and (args.by_activity or args.plot_snakey or
+                          args.count_tags or args.watch or args.validate or
+                          args.export_file):
+        # Only the totals are rolled up by date, filter the records for others
+        args.where = (args.where or [])+\
+            (["date>="+args.date_from.isoformat()] if args.date_from else [])+\
+            (["date<="+args.date_to.isoformat()] if args.date_to else [])
+        in_date_range = False
+    filtering = args.line_incls or args.line_excls or args.where
+    if args.watch:
+        if linereader.STDIN in args.file_name:
+            argparser.error("Cannot --watch the standard input")
+        import watcher
+        record_filter = None
+        if filtering:
+            record_filter = lambda records: _filter_records(records,
+                args.line_incls, args.line_excls, args.where)
+        journal_watcher = watcher.JournalWatcher(args.file_name, args.cat,
+                                                 record_filter)
+        if args.watch_port:
+            watcher.serve_snapshots(journal_watcher, args.watch_port)
+        try:
+            watcher.watch(journal_watcher, min2str, args.watch_interval)
+        except KeyboardInterrupt:
+            pass
+        exit()
+
+    if args.count_tags and not (filtering or args.by_period or
+                                args.tags_by_cat):
+        # Also the tags outside the records are counted, stream all files
+        import tagcount
+        with stats.stage('count_tags'):
+            tag_counts = tagcount.count_files(args.file_name, tag_to_tag,
+                                              args.jobs)
+        if stats.enabled:
+            # The tags are counted without parsing, parse for the counters
+            with stats.stage('count_lines'):
+                runstats.count_records(stats,
+                                       linereader.parse_files(args.file_name))
+        _print_tag_counts(tag_counts, args.tags_top, args.tags_min_count)
+        exit()
+    
+    # The plain totals are summarized as the lines are parsed unless the
+    #  cache, the processes or the --stats stages need the table of records
+    stream_totals = not (filtering or args.validate or args.count_tags or
+                         args.export_file or args.plot_snakey or
+                         args.by_activity or in_date_range or
+                         args.scale_to_mins or stats.enabled or
+                         args.jobs>1) and (args.no_cache or all(
+                             fn==linereader.STDIN for fn in args.file_name))
+    records = None
+    if not stream_totals:
+        # stream the lines from all the changed files to a table of records
+        cache = None
+        if not args.no_cache:
+            import parsecache
+            cache = parsecache.ParseCache(args.cache_dir)
+            if args.clear_cache:
+                cache.clear()
+        with stats.stage('read_and_parse'):
+            records = linereader.parse_files(args.file_name, jobs=args.jobs,
+                                             cache=cache, stats=stats)
+        runstats.count_records(stats, records)
+    if filtering:
+        try:
+            with stats.stage('filter'):
+                records = _filter_records(records, args.line_incls,
+                                          args.line_excls, args.where)
+        except ValueError as e:
+            argparser.error(str(e))
+        stats.count('filtered_records', len(records))
+        if args.show_included:
+            for l in records.lines(linereader.record_lines(records)):
+                print(l)
     
+    if args.validate:
+        import json
+        import sys
+        import validation
+        with stats.stage('validate'):
+            report = validation.validate_records(records, args.min_gap,
+                linereader.record_lines(records))
+        json.dump(report, sys.stdout, indent=2)
+        print()
+        exit(1 if report['issues'] else 0)
+
     if args.count_tags:
-        tag_counts = Counter()
-        for line in all_lines:
-            tags = lineparser.get_tags(line, tag_to_tag)
-            if tags:
-                tag_counts.update(tags)
-        for tag, tag_count in tag_counts.most_common():
-            print(tag_count, tag)
+        import tagcount
+        with stats.stage('count_tags'):
+            tag_counts = tagcount.count_records(records, tag_to_tag,
+                                                args.by_period,
+                                                args.tags_by_cat)
+        if not (args.by_period or args.tags_by_cat):
+            _print_tag_counts(tag_counts, args.tags_top, args.tags_min_count)
+        else:
+            for label, label_counts in sorted(tag_counts.items()):
+                print(label)
+                _print_tag_counts(label_counts, args.tags_top,
+                                  args.tags_min_count, "  ")
         exit()
 
     # Check for special tag
     ALL_tag_cats = []
-    all_cats = set()
-    for line in all_lines:
-        if lineparser.is_timelog_line(line):            
-            all_cats = all_cats.union(lineparser.get_categories_from(line))
+    if records is None:
+        # Without the table, the categories are scanned only if needed
+        all_cats = set()
+        if linereader.contains(args.file_name, '@ALL'):
+            all_cats = linereader.scan_categories(args.file_name)
+    else:
+        all_cats = records.categories()
     if '@ALL' in all_cats:
         all_cats.remove('@ALL')
-        ALL_tag_cats = list(all_cats)
+        ALL_tag_cats = sorted(all_cats)
+
+    summarize_quietly = lambda *a, **kw: lineparser.summarize_records(
+        *a, do_print=False, **kw)
+    if args.backend=='numpy':
+        import columnar
+        summarize_quietly = columnar.summarize_records
+
+    if args.export_file:
+        with stats.stage('export'):
+            if args.export_rows=='records':
+                rows = export.record_rows(records, args.cat, ALL_tag_cats,
+                                          tag_to_tag)
+                fields = export.RecordRow._fields
+            else:
+                # The activities keep the @ALL as is, as with --activity
+                also_tags = args.export_rows=='activity'
+                rows = export.summary_rows(summarize_quietly(records,
+                    args.cat, also_tags=also_tags,
+                    all_tags_replacement=[] if also_tags else ALL_tag_cats,
+                    tag_translator=tag_to_tag))
+                fields = export.SummaryRow._fields
+                if not also_tags:
+                    fields = ('cat', 'minutes')
+                    rows = ((row.cat, row.minutes) for row in rows)
+            try:
+                export.export_rows(rows, fields, args.export_file)
+            except (ValueError, ImportError) as e:
+                argparser.error(str(e))
+        exit()
+
+    if args.plot_snakey or args.by_activity:
+        with stats.stage('summarize'):
+            ttpc = summarize_quietly(records, args.cat,
+                also_tags=True, tag_translator=tag_to_tag )
 
     if args.plot_snakey:
-        ttpc = lineparser.parse_and_summarize(all_lines, args.cat,
-            also_tags=True, tag_translator=tag_to_tag, do_print=False )
         from timetracking_snakey_plotter import plot_timetracking_data
-        plot_timetracking_data(ttpc, not args.no_snakey_specifiers)
+        with stats.stage('plot'):
+            plot_timetracking_data(ttpc, not args.no_snakey_specifiers,
+                args.snakey_top, args.snakey_min_minutes, args.snakey_output)
 
     if args.by_activity:
         print("BY ACTIVITY:")
-        ttpc = lineparser.parse_and_summarize(all_lines, args.cat,
-            also_tags=True, tag_translator=tag_to_tag, do_print=False )
-
         
-        for cat, cat_data in sorted(ttpc.items()):
-            cat_minutes, activities = cat_data
-            print("CAT", cat, min2str(int(cat_minutes)))
-            for act, act_data in sorted(activities.items()):
-                act_minutes, _ = act_data
-                if act_minutes>0:
-                    percentage = act_minutes/cat_minutes*100
-                    act_hourss = min2str(int(act_minutes))
-                    print(f"  {act} {act_hourss} ({percentage:.1f}%)")
+        for row in export.summary_rows(ttpc, with_specifiers=False):
+            if row.activity is None:
+                cat_minutes = row.minutes
+                print("CAT", row.cat, min2str(int(cat_minutes)))
+            elif row.minutes>0:
+                percentage = row.minutes/cat_minutes*100
+                act_hourss = min2str(int(row.minutes))
+                print(f"  {row.activity} {act_hourss} ({percentage:.1f}%)")
             
 
+    elif in_date_range:
+        import rollups
+        with stats.stage('summarize'):
+            rollup = rollups.DailyRollup(records, args.cat, ALL_tag_cats)
+            tpc = rollup.totals(args.date_from, args.date_to)
+        min_scaler = 1.0
+        if args.scale_to_mins:
+            min_scaler = float(args.scale_to_mins)/sum(tpc.values())
+
+        with stats.stage('print'):
+            for period, first_date, last_date in rollup.periods(
+                    args.by_period or 'day', args.date_from, args.date_to):
+                period_tpc = rollup.totals(first_date, last_date)
+                if not period_tpc:
+                    continue
+                print(period, ":",
+                      min2str(sum(period_tpc.values())*min_scaler))
+                if args.by_period and args.by_period!='day':
+                    for cat, cat_minutes in sorted(period_tpc.items()):
+                        print(" ", cat, min2str(int(cat_minutes*min_scaler)))
+            print()
+            print("TOTAL:")
+            tot_tot_mins = 0
+            for row in export.summary_rows(tpc):
+                print(row.cat, min2str(int(row.minutes*min_scaler)))
+                tot_tot_mins+=row.minutes*min_scaler
+            print("TOTALTOTAL:", min2str(int(tot_tot_mins)))
+
     else:
         min_scaler = 1.0
         if args.scale_to_mins:
-            total_mins = sum( lineparser.parse_and_summarize(all_lines, args.cat, 
-                        all_tags_replacement=ALL_tag_cats, do_print=False).values() )
+            total_mins = sum( summarize_quietly(records, args.cat, 
+                        all_tags_replacement=ALL_tag_cats).values() )
             min_scaler = float(args.scale_to_mins)/total_mins
         
-        tpc = lineparser.parse_and_summarize(all_lines, args.cat, 
-                duration_scaler=min_scaler,
-                all_tags_replacement=ALL_tag_cats,
-                min2str=min2str ) 
-        print()
-        print("TOTAL:")
-        tot_tot_mins = 0
-        for cat, cat_minutes in sorted(tpc.items()):
-            print(cat, min2str(int(cat_minutes)))
-            #print(cat, "%.2f"%(cat_minutes/(22*7.5*60)))
-            tot_tot_mins+=cat_minutes
-        print("TOTALTOTAL:", min2str(int(tot_tot_mins)))
+        with stats.stage('summarize'):
+            if records is None:
+                records = lineparser.RecordTable()
+                tpc = lineparser.summarize_stream(
+                    linereader.iter_records(args.file_name, records),
+                    records, args.cat, all_tags_replacement=ALL_tag_cats,
+                    min2str=min2str)
+            else:
+                tpc = lineparser.summarize_records(records, args.cat, 
+                    duration_scaler=min_scaler,
+                    all_tags_replacement=ALL_tag_cats,
+                    min2str=min2str, lines=linereader.record_lines(records),
+                    stats=stats ) 
+        with stats.stage('print'):
+            print()
+            print("TOTAL:")
+            tot_tot_mins = 0
+            for row in export.summary_rows(tpc):
+                print(row.cat, min2str(int(row.minutes)))
+                #print(cat, "%.2f"%(cat_minutes/(22*7.5*60)))
+                tot_tot_mins+=row.minutes
+            print("TOTALTOTAL:", min2str(int(tot_tot_mins)))
         
\ No newline at end of file
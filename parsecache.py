@@ -0,0 +1,169 @@
+from hashlib import sha1
+import io
+import os
+import pickle
+
+import linereader
+
+# Bump this when the format of the `lineparser.RecordTable` changes
+CACHE_VERSION = 5
+
+def default_cache_dir():
+    cache_home = os.environ.get('XDG_CACHE_HOME',
+                                os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(cache_home, 'timetrackingsummarizer')
+
+def _scan_file(file_name, size=None):
+    """ Helper to hash the (first `size` bytes of the) file content. Returns
+    the hash and the number of newlines. """
+    h, n_newlines = sha1(), 0
+    remaining = size
+    with open(file_name, 'rb') as f:
+        while remaining is None or remaining>0:
+            block = f.read(1<<20 if remaining is None else min(1<<20, remaining))
+            if not block:
+                break
+            h.update(block)
+            n_newlines += block.count(b'\n')
+            if remaining is not None:
+                remaining -= len(block)
+    return h.hexdigest(), n_newlines
+
+def _ends_with_newline(file_name, size):
+    if size==0:
+        return True
+    with open(file_name, 'rb') as f:
+        f.seek(size-1)
+        return f.read(1)==b'\n'
+
+class ParseCache:
+    """ An on-disk cache of the parsed `lineparser.RecordTable` per file.
+
+    An entry is valid if the size and the modification time of the file are
+    unchanged, or if the content hash still matches. If the file has only
+    grown by appending lines, just the new tail is parsed and added to the
+    cached records. An entry is a small header followed by the records, so
+    that the records are unpickled only if the header is valid. The least
+    recently used entries are evicted (see `evict`) when the cache grows
+    over `max_bytes`.
+    """
+    def __init__(self, cache_dir=None, max_bytes=256*1024*1024):
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.max_bytes = max_bytes
+        self._written = False
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _entry_path(self, file_name):
+        key = sha1(os.path.abspath(file_name).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, key+'.pickle')
+
+    def _read_entry(self, file_name, with_records=False):
+        """ Helper to read the header of the entry (and its records). """
+        try:
+            with open(self._entry_path(file_name), 'rb') as f:
+                entry = pickle.load(f)
+                if entry.get('version')!=CACHE_VERSION:
+                    return None
+                if with_records:
+                    entry['records'] = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError,
+                ImportError, TypeError, ValueError):
+            return None
+        return entry
+
+    def _write_entry(self, file_name, entry, records):
+        path = self._entry_path(file_name)
+        tmp_path = path+'.tmp%d'%os.getpid()
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(records, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        self._written = True
+
+    def load(self, file_name):
+        """ Returns the cached records of the file (with the appended tail
+        parsed) or `None` if the file needs to be parsed again. """
+        try:
+            st = os.stat(file_name)
+        except OSError:
+            return None
+        entry = self._read_entry(file_name)
+        if entry is None:
+            return None
+
+        touched = False
+        if st.st_size==entry['size'] and st.st_mtime_ns==entry['mtime_ns']:
+            os.utime(self._entry_path(file_name)) # mark as recently used
+        elif st.st_size==entry['size']:
+            if _scan_file(file_name)[0]!=entry['hash']:
+                return None
+            touched = True
+        elif not (st.st_size>entry['size'] and entry['appendable'] and
+                  _scan_file(file_name, entry['size'])[0]==entry['hash']):
+            return None
+
+        entry = self._read_entry(file_name, with_records=True) or {}
+        records = entry.pop('records', None)
+        if records is None:
+            return None
+        if st.st_size>entry['size']:
+            with open(file_name, 'rb') as f:
+                f.seek(entry['size'])
+                tail_lines = io.TextIOWrapper(f).readlines()
+            records.parse(tail_lines, file_name, entry['n_lines']+1)
+            self.store(file_name, records)
+        elif touched:
+            entry['mtime_ns'] = st.st_mtime_ns
+            self._write_entry(file_name, entry, records)
+
+        if any(source!=file_name for source in records.sources):
+            records.set_source(file_name)
+        return records
+
+    def store(self, file_name, records):
+        """ Stores the records parsed from the (current content of) file. """
+        try:
+            st = os.stat(file_name)
+        except OSError:
+            return
+        content_hash, n_newlines = _scan_file(file_name)
+        self._write_entry(file_name, {
+            'version': CACHE_VERSION,
+            'size': st.st_size,
+            'mtime_ns': st.st_mtime_ns,
+            'hash': content_hash,
+            # Only plain files that end to a full line can be appended to
+            'appendable': (not linereader.is_compressed(file_name) and
+                           _ends_with_newline(file_name, st.st_size)),
+            'n_lines': n_newlines}, records)
+
+    def evict(self):
+        """ Evicts the least recently used entries over the `max_bytes` if
+        any entries were written since the last call. Called once per run
+        rather than on each write, as it lists the whole cache. """
+        if not self._written:
+            return
+        self._written = False
+        entries = []
+        for entry_name in os.listdir(self.cache_dir):
+            try:
+                st = os.stat(os.path.join(self.cache_dir, entry_name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, entry_name))
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, entry_name in sorted(entries):
+            if total_bytes<=self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, entry_name))
+            except OSError:
+                pass
+            total_bytes -= size
+
+    def clear(self):
+        for entry_name in os.listdir(self.cache_dir):
+            try:
+                os.remove(os.path.join(self.cache_dir, entry_name))
+            except OSError:
+                pass
@@ -0,0 +1,106 @@
+from datetime import date
+import operator
+import re
+
+class LineFilter:
+    """ The include and exclude lists of `--lnincl` and `--lnexcl` compiled
+    to combined regular expressions.
+
+    A line passes if it contains all the include texts and none of the
+    exclude texts. If there are no include texts, it is enough that the line
+    contains none of the exclude texts. With includes but no excludes, also
+    the lines missing an include text are dropped.
+    """
+    def __init__(self, line_incls=None, line_excls=None):
+        self.line_incls = list(dict.fromkeys(line_incls or []))
+        self.line_excls = list(dict.fromkeys(line_excls or []))
+        self._excl_re = _alternation(self.line_excls, "")
+        # The lookahead finds (the longest) include text at each position.
+        #  As the shorter texts contained in it are then also on the line, the
+        #  containment closure gives all the included texts that were found.
+        self._incl_re = _alternation(self.line_incls, "(?=(%s))")
+        self._contained = {lf:{other for other in self.line_incls
+                               if other in lf}
+                           for lf in self.line_incls}
+
+    def has_all_incls(self, l):
+        if len(self.line_incls)==1:
+            return self.line_incls[0] in l
+        found = set()
+        for lf in set(self._incl_re.findall(l)):
+            found |= self._contained[lf]
+        return len(found)==len(self.line_incls)
+
+    def has_no_excls(self, l):
+        return not self._excl_re.search(l)
+
+    def __call__(self, l):
+        if not self.line_incls and not self.line_excls:
+            return True
+        if self.line_incls and self.has_all_incls(l):
+            return not self.line_excls or self.has_no_excls(l)
+        elif self.line_excls:
+            return self.has_no_excls(l)
+        return False
+
+def _alternation(texts, template):
+    if not texts:
+        return None
+    longest_first = sorted(texts, key=len, reverse=True)
+    pattern = "|".join(map(re.escape, longest_first))
+    return re.compile(template%pattern if template else pattern)
+
+_where_re = re.compile(
+    r"(?P<negate>-)?(?:(?P<field>tag|cat):(?P<tag>\@\w+)|"
+    r"date(?P<op><=|>=|<|>|=)(?P<date>\d{4}-\d{1,2}-\d{1,2}))$")
+_date_ops = {'<=':operator.le, '>=':operator.ge, '<':operator.lt,
+             '>':operator.gt, '=':operator.eq}
+
+def parse_where(terms):
+    """ Parses the `--where` predicate terms. All the terms must hold:
+     * ``tag:@Tag`` the record has this (non-category) tag
+     * ``cat:@CAT`` the record has this category
+     * ``date>=2022-03-01`` the date of the record is in the range, also the
+       operators ``<=``, ``<``, ``>`` and ``=`` can be used
+    Any term can be negated with a ``-`` prefix, e.g., ``-tag:@Lunch``.
+
+    Returns a list of (negate, field, op, value) tuples.
+    """
+    parsed = []
+    for term in terms:
+        for word in term.split():
+            mo = _where_re.match(word)
+            if not mo:
+                raise ValueError("Invalid filter term: "+word)
+            if mo.group('field'):
+                parsed.append((bool(mo.group('negate')), mo.group('field'),
+                               None, mo.group('tag')))
+            else:
+                parsed.append((bool(mo.group('negate')), 'date',
+                               _date_ops[mo.group('op')],
+                               date(*map(int, mo.group('date').split('-')))))
+    return parsed
+
+def compile_record_filter(records, line_incls=None, line_excls=None,
+                          where=None):
+    """ Compiles the line include and exclude texts and the `parse_where`
+    terms to a single predicate for `lineparser.RecordTable.filter`. The
+    line texts are needed only to filter by `line_incls` or `line_excls`. """
+    line_filter = LineFilter(line_incls, line_excls)
+    terms = parse_where(where or [])
+    day_dates = records.day_dates() if any(
+        field=='date' for _, field, _, _ in terms) else None
+
+    def predicate(rec, line=None):
+        for negate, field, op, value in terms:
+            if field=='cat':
+                holds = value in rec.cats
+            elif field=='tag':
+                holds = value in rec.tags and value not in rec.cats
+            else:
+                rec_date = day_dates[rec.day]
+                holds = rec_date is not None and op(rec_date, value)
+            if holds==negate:
+                return False
+        return line is None or line_filter(line)
+    return predicate
@@ -0,0 +1,106 @@
+from datetime import date, timedelta
+from itertools import accumulate
+
+import lineparser
+
+class DailyRollup:
+    """ Per-day, per-category totals stored densely by date with prefix sums.
+
+    After building the rollup once from a `lineparser.RecordTable`, the total
+    of any category over any date range is a difference of two prefix sums.
+    The durations are split to the categories as in the totals of
+    `lineparser.summarize_records`. The records without a (valid) date are
+    left out.
+
+    Parameters
+    ----------
+    records : `lineparser.RecordTable`
+       The records to roll up.
+    only_cat : `str`
+       Only durations for this category tag are calculated.
+    all_tags_replacement : `list`
+       Can be used to alias 'ALL' category to serveral.
+    """
+    def __init__(self, records, only_cat=None, all_tags_replacement=[]):
+        dates = records.day_dates()
+        used_dates = {dates[rec.day] for rec in records} - {None}
+        self.first_date = min(used_dates) if used_dates else None
+        self.last_date = max(used_dates) if used_dates else None
+        self.n_days = n_days = ((self.last_date-self.first_date).days+1
+                                if used_dates else 0)
+
+        day_idx = [None if d is None or self.first_date is None
+                   else (d-self.first_date).days for d in dates]
+        daily = {}
+        for rec in records:
+            idx = day_idx[rec.day]
+            if idx is None:
+                continue
+            cats = lineparser.replace_all_tag(rec.cats, all_tags_replacement)
+            for cat in cats:
+                if only_cat and only_cat!=cat:
+                    continue
+                if cat not in daily:
+                    daily[cat] = [0.0]*n_days
+                daily[cat][idx] += (rec.end-rec.start)/len(cats)
+
+        # prefix[cat][i] is the total of the days before the day i
+        self.prefix = {cat:list(accumulate(minutes, initial=0.0))
+                       for cat, minutes in daily.items()}
+
+    def _index_range(self, date_from=None, date_to=None):
+        """ Helper to clamp the inclusive date range to day indices. """
+        if self.first_date is None:
+            return 0, 0
+        start, end = 0, self.n_days
+        if date_from is not None:
+            start = min(max(0, (date_from-self.first_date).days), self.n_days)
+        if date_to is not None:
+            end = min(max(0, (date_to-self.first_date).days+1), self.n_days)
+        return start, max(start, end)
+
+    def total(self, cat, date_from=None, date_to=None):
+        """ Returns the minutes of the category within the dates (inclusive).
+        """
+        if cat not in self.prefix:
+            return 0.0
+        start, end = self._index_range(date_from, date_to)
+        return round(self.prefix[cat][end]-self.prefix[cat][start], 6)
+
+    def totals(self, date_from=None, date_to=None):
+        """ Returns the minutes per category within the dates (inclusive).
+        The categories with no time in the range are left out. """
+        start, end = self._index_range(date_from, date_to)
+        totals = {}
+        for cat, prefix in self.prefix.items():
+            # Round off the error of the prefix sum differences
+            minutes = round(prefix[end]-prefix[start], 6)
+            if minutes:
+                totals[cat] = minutes
+        return totals
+
+    def periods(self, by, date_from=None, date_to=None):
+        """ Generates the (label, first_date, last_date) of each day, week
+        (ISO) or month (`by`) that overlaps the date range. """
+        if self.first_date is None:
+            return
+        date_from = max(date_from or self.first_date, self.first_date)
+        date_to = min(date_to or self.last_date, self.last_date)
+        day = date_from
+        while day<=date_to:
+            label, last = period_of(day, by)
+            yield label, day, min(last, date_to)
+            day = last+timedelta(days=1)
+
+def period_of(day, by):
+    """ Returns the label and the last date of the day, week (ISO) or month
+    (`by`) of the `datetime.date`. """
+    if by=='day':
+        return day.isoformat(), day
+    elif by=='week':
+        year, week, weekday = day.isocalendar()
+        return f"{year}-W{week:02d}", day+timedelta(days=7-weekday)
+    elif by=='month':
+        next_month = date(day.year+day.month//12, day.month%12+1, 1)
+        return f"{day.year}-{day.month:02d}", next_month-timedelta(days=1)
+    raise ValueError("Unknown period: "+by)
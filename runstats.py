@@ -0,0 +1,118 @@
+from contextlib import contextmanager, nullcontext
+from time import perf_counter
+import sys
+
+class Stats:
+    """ Per-stage wall-clock timers and counters of a run.
+
+    The stages are timed with ``with stats.stage('parse'): ...`` and the
+    counters increased with ``stats.count('lines', n)``. The code paths take
+    the `disabled` instance when no statistics are wanted, so that nothing
+    is measured nor counted.
+    """
+    enabled = True
+
+    def __init__(self):
+        self.timings = {}
+        self.counters = {}
+        self._profiler = None
+        self._profile_path = None
+        self._trace_memory = False
+        self.memory = None
+
+    @contextmanager
+    def stage(self, name):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0)+\
+                perf_counter()-start
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0)+n
+
+    def start_profiling(self, profile_path=None, trace_memory=False):
+        """ Starts capturing a cProfile (dumped to the `profile_path`) and/or
+        the memory allocations with tracemalloc. """
+        if profile_path:
+            import cProfile
+            self._profile_path = profile_path
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        if trace_memory:
+            import tracemalloc
+            self._trace_memory = True
+            tracemalloc.start()
+
+    def stop_profiling(self):
+        if self._profiler:
+            self._profiler.disable()
+            self._profiler.dump_stats(self._profile_path)
+            self._profiler = None
+        if self._trace_memory:
+            import tracemalloc
+            current, peak = tracemalloc.get_traced_memory()
+            top = tracemalloc.take_snapshot().statistics('lineno')[:10]
+            tracemalloc.stop()
+            self._trace_memory = False
+            self.memory = {
+                'current_bytes': current,
+                'peak_bytes': peak,
+                'top_allocations': [{'location': str(s.traceback),
+                                     'bytes': s.size, 'count': s.count}
+                                    for s in top]}
+
+    def as_dict(self):
+        result = {'timings': self.timings, 'counters': self.counters}
+        if self.memory:
+            result['memory'] = self.memory
+        return result
+
+    def emit(self, out=None):
+        """ Writes the statistics as JSON (to stderr by default, to keep the
+        stdout for the summaries). """
+        import json
+        self.stop_profiling()
+        json.dump(self.as_dict(), out or sys.stderr, indent=2)
+        (out or sys.stderr).write("\n")
+
+class _DisabledStats:
+    enabled = False
+
+    def stage(self, name):
+        return nullcontext()
+
+    def count(self, name, n=1):
+        pass
+
+disabled = _DisabledStats()
+
+def count_records(stats, records):
+    """ Counts the lines, the date lines, the timelog lines, the distinct
+    tags and categories of a `lineparser.RecordTable`, and the overlaps and
+    the records without categories that the summaries warn about. """
+    if not stats.enabled:
+        return
+    n_dates = len(records.date_lines)-1
+    stats.count('lines_read', records.n_lines)
+    stats.count('date_lines', n_dates)
+    stats.count('timelog_lines', len(records))
+    stats.count('unmatched_lines', records.n_lines-n_dates-len(records))
+    stats.count('distinct_categories', len(records.categories()))
+
+    tags = set()
+    n_overlaps, n_no_cats = 0, 0
+    prev_day, prev_time_to = 0, 0
+    for rec in records:
+        if rec.day!=prev_day:
+            prev_day, prev_time_to = rec.day, 0
+        if rec.start<prev_time_to:
+            n_overlaps += 1
+        prev_time_to = rec.end
+        if not rec.cats:
+            n_no_cats += 1
+        tags.update(tag for tag in rec.tags if tag not in rec.cats)
+    stats.count('overlap_warnings', n_overlaps)
+    stats.count('records_without_categories', n_no_cats)
+    stats.count('distinct_tags', len(tags))
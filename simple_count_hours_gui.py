@@ -2,7 +2,6 @@
 
 from sys import stdin
 from math import floor
-from datetime import datetime, timedelta
 import re
 import argparse
 
@@ -13,46 +12,96 @@ line_re = re.compile(
     r"(,)?\s+(?P<description>.*)" # Rest of the line
 )
 
-def calculate_total_time(lines):
-    total_minutes = 0
-    for line in lines:
-        mo = line_re.match(line)
-        if mo:
-            from_dt = datetime(year=datetime.now().year,
-                            month=datetime.now().month,
-                            day=datetime.now().day,
-                            hour=int(mo.group('from_hour')),
-                            minute=int(mo.group('from_min')))
-            to_dt   = datetime(year=datetime.now().year,
-                            month=datetime.now().month,
-                            day=datetime.now().day,
-                            hour=int(mo.group('to_hour')),
-                            minute=int(mo.group('to_min')))
-            task_duration:timedelta = to_dt-from_dt
-            total_minutes  += int(task_duration.total_seconds()/60.0)
+def _to_minutes(hour, minute):
+    """Helper to convert the clock time to minutes from the midnight."""
+    hour, minute = int(hour), int(minute)
+    if not 0<=hour<=23 or not 0<=minute<=59:
+        raise ValueError(f"Invalid time {hour}:{minute:02d}")
+    return hour*60+minute
+
+def line_minutes(line):
+    """Returns the duration of the line in minutes (0 if it is not a valid
+    timesheet line)."""
+    mo = line_re.match(line)
+    if not mo:
+        return 0
+    return (_to_minutes(mo.group('to_hour'), mo.group('to_min'))-
+            _to_minutes(mo.group('from_hour'), mo.group('from_min')))
+
+def format_minutes(total_minutes):
     total_hours = floor(total_minutes/60)
     remaining_minutes = total_minutes-total_hours*60
     return (f"{total_hours}:{remaining_minutes:02d}")
 
-def show_gui():
+class LineTotals:
+    """ Keeps the duration of each line and their total.
+
+    On `update` the new lines are compared to the previous ones and only the
+    lines between the unchanged beginning and end are evaluated again, so
+    an edit costs about the size of the edit, not of the whole timesheet.
+    """
+    def __init__(self):
+        self.lines = []
+        self.minutes = []
+        self.total_minutes = 0
+
+    def update(self, lines):
+        old_lines = self.lines
+        n_max = min(len(old_lines), len(lines))
+        start = 0
+        while start<n_max and old_lines[start]==lines[start]:
+            start += 1
+        end = 0
+        while end<n_max-start and old_lines[-end-1]==lines[-end-1]:
+            end += 1
+
+        new_minutes = [line_minutes(line)
+                       for line in lines[start:len(lines)-end]]
+        old_minutes = self.minutes[start:len(old_lines)-end]
+        self.minutes[start:len(old_lines)-end] = new_minutes
+        self.lines = list(lines)
+        self.total_minutes += sum(new_minutes)-sum(old_minutes)
+        return self.total_minutes
+
+    def total(self):
+        return format_minutes(self.total_minutes)
+
+def calculate_total_time(lines):
+    line_totals = LineTotals()
+    line_totals.update(lines)
+    return line_totals.total()
+
+def show_gui(live_delay_ms=300):
     import PySimpleGUI as sg
     total = ""
+    line_totals = LineTotals()
     sg.theme('Dark Blue 3')
     layout = [[sg.Multiline('Copy-Paste or write the timesheet here',
-                            size=(60,10), key='-TIMESHEET TEXT-')],
-              [sg.Button('Calculate'), sg.Button('Exit')]]
+                            size=(60,10), key='-TIMESHEET TEXT-',
+                            enable_events=True)],
+              [sg.Text('Total', size=(30,1), key='-TOTAL-')],
+              [sg.Button('Calculate'),
+               sg.Checkbox('Live', key='-LIVE-', enable_events=True),
+               sg.Button('Exit')]]
     window = sg.Window('Timesheet sum calculator', layout)
+    pending = False
     while True:  # Event Loop
-        event, values = window.read()
+        # Recalculate when the text has not changed for a while (debounce)
+        event, values = window.read(timeout=live_delay_ms if pending else None)
         if event in (sg.WIN_CLOSED, 'Exit'):
             break
-        if event == 'Calculate':
-            lines = re.split('\n\n|\r\n|\n', values['-TIMESHEET TEXT-'])
-            total = calculate_total_time(lines)
-            # Just append the total to the input field
-            window['-TIMESHEET TEXT-'].update( 
-                "" if not lines else "\n".join(lines)+
-                '\n'+"Total "+total )
+        if event in ('-TIMESHEET TEXT-', '-LIVE-'):
+            pending = values['-LIVE-']
+        elif event == 'Calculate' or (event == sg.TIMEOUT_EVENT and pending):
+            pending = False
+            lines = values['-TIMESHEET TEXT-'].splitlines()
+            try:
+                line_totals.update(lines)
+                total = line_totals.total()
+                window['-TOTAL-'].update("Total "+total)
+            except ValueError as e:
+                line_totals = LineTotals()
+                window['-TOTAL-'].update(str(e))
     window.close()
     return total
 
@@ -0,0 +1,110 @@
+from fnmatch import translate
+from functools import lru_cache
+from sys import intern
+import re
+
+class TagAliases:
+    """ The `--taf` tag alias rules compiled once to a memoized translator.
+
+    Each rule is a line ``@ReadTag = @Alias`` (the older ``@ReadTag, =@Alias``
+    also works). The read tag can be a wildcard pattern such as
+    ``@Meeting*`` or a regular expression prefixed with ``re:``, e.g.,
+    ``re:@(Email|Mail)s?``. The exact rules are tried first and then the
+    patterns in the order of the file. Chained rules (A=B, B=C) are followed
+    to the end, and a cycle of rules raises a `ValueError` already when the
+    rules are compiled.
+
+    Parameters
+    ----------
+    rules : `list`
+       The (read tag, alias) pairs, see `parse_rules`.
+    ignore_case : `bool`
+       Match the read tags regardless of their case.
+    cache_size : `int`
+       How many of the translated tags to remember.
+    """
+    def __init__(self, rules=(), ignore_case=False, cache_size=65536):
+        self.ignore_case = ignore_case
+        exact, patterns, self._pattern_aliases = {}, [], []
+        for from_tag, to_tag in rules:
+            if from_tag.startswith("re:"):
+                patterns.append(from_tag[3:])
+            elif any(c in from_tag for c in "*?["):
+                # fnmatch gives "(?s:...)\Z", the fullmatch is enough
+                patterns.append(translate(from_tag)[:-2])
+            else:
+                exact.setdefault(self._key(from_tag), intern(to_tag))
+                continue
+            self._pattern_aliases.append(intern(to_tag))
+
+        # A single regex with a group per pattern rule, the first one wins
+        self._pattern_re = None
+        if patterns:
+            self._pattern_re = re.compile(
+                "|".join(f"(?P<r{i}>{p})" for i, p in enumerate(patterns)),
+                re.IGNORECASE if ignore_case else 0)
+
+        # Resolve the chains of the exact rules (and their cycles) up front
+        self._exact = exact
+        self._exact = {key:self._resolve(to_tag, [key])
+                       for key, to_tag in exact.items()}
+        # Any cycle through the patterns passes the alias of a pattern rule
+        for to_tag in self._pattern_aliases:
+            self._resolve(to_tag, [])
+        self.translate = lru_cache(maxsize=cache_size)(self._translate)
+
+    def __bool__(self):
+        return bool(self._exact) or self._pattern_re is not None
+
+    def __call__(self, tag):
+        return self.translate(tag)
+
+    def _key(self, tag):
+        return tag.casefold() if self.ignore_case else tag
+
+    def _step(self, tag):
+        """ Helper to apply one rule, returns `None` if none applies. """
+        key = self._key(tag)
+        if key in self._exact:
+            return self._exact[key]
+        if self._pattern_re:
+            mo = self._pattern_re.fullmatch(tag)
+            if mo:
+                return self._pattern_aliases[int(mo.lastgroup[1:])]
+        return None
+
+    def _resolve(self, tag, path):
+        """ Helper to follow the rules from the `tag` to the final alias.
+        The `path` has the keys of the tags that led to the `tag`. """
+        path.append(self._key(tag))
+        while True:
+            next_tag = self._step(tag)
+            if next_tag is None:
+                return tag
+            key = self._key(next_tag)
+            if key==path[-1]:
+                # A rule to the tag itself, e.g., "@Meeting* = @Meeting"
+                return next_tag
+            if key in path:
+                raise ValueError("Cycle in the tag aliases: "+
+                                 " = ".join(path+[key]))
+            path.append(key)
+            tag = next_tag
+
+    def _translate(self, tag):
+        return intern(self._resolve(tag, []))
+
+def parse_rules(lines):
+    """ Parses the (read tag, alias) pairs from the lines of a tag alias
+    file. The empty lines and the lines starting with ``#`` are skipped. """
+    rules = []
+    for alias_line in lines:
+        alias_line = alias_line.strip()
+        if not alias_line or alias_line.startswith("#") or \
+                "=" not in alias_line:
+            continue
+        from_tag, to_tag = alias_line.split("=", 1)
+        from_tag, to_tag = from_tag.strip(" ,\t"), to_tag.strip()
+        if from_tag and to_tag:
+            rules.append((from_tag, to_tag))
+    return rules
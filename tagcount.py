@@ -0,0 +1,97 @@
+from collections import Counter
+
+import lineparser
+import linereader
+import rollups
+
+def count_blocks(blocks):
+    """ Counts the @Tags in the blocks of text. Each block is scanned with a
+    single `lineparser.tag_re` pass up to its last line break (the rest is
+    carried to the next block), so no list of lines, or of the tags per
+    line, is built. The tags are counted in the order of their first
+    appearance. """
+    tag_counts = Counter()
+    tail = ""
+    for block in blocks:
+        text = tail+block
+        cut = text.rfind("\n")+1
+        tag_counts.update(lineparser.tag_re.findall(text, 0, cut))
+        tail = text[cut:]
+    tag_counts.update(lineparser.tag_re.findall(tail))
+    return tag_counts
+
+def count_file(file_name, block_size=1<<20):
+    """ Counts the @Tags of a file read in blocks of `block_size`
+    characters, see `count_blocks`. """
+    with linereader.open_journal(file_name) as f:
+        return count_blocks(iter(lambda: f.read(block_size), ""))
+
+def translate(tag_counts, tag_translator=lambda tag:tag):
+    """ Merges the counts of the tags that translate to the same tag. As the
+    tags are translated in the order of their first appearance, so are the
+    merged ones. """
+    translated = Counter()
+    for tag, tag_count in tag_counts.items():
+        translated[tag_translator(tag)] += tag_count
+    return translated
+
+def count_files(file_names, tag_translator=lambda tag:tag, jobs=1):
+    """ Counts the @Tags on all the lines of the files. With `jobs` > 1 the
+    files are counted in a pool of processes and the counters merged in
+    the input order, so the result (also the order of the ties) is the same
+    as of a serial run. The standard input is always counted serially. """
+    file_names = list(linereader.expand_file_names(file_names))
+    tag_counts = Counter()
+    if jobs<=1 or linereader.STDIN in file_names:
+        for fn in file_names:
+            tag_counts.update(count_file(fn))
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(jobs) as executor:
+            for file_counts in executor.map(count_file, file_names):
+                tag_counts.update(file_counts)
+    return translate(tag_counts, tag_translator)
+
+def count_records(records, tag_translator=lambda tag:tag, by_period=None,
+                  by_cat=False):
+    """ Counts the @Tags of a `lineparser.RecordTable`.
+
+    Without a breakdown the tags of the records and of the date lines are
+    counted to a single `Counter` in the order of the lines.
+    Otherwise, returns a dict of the counts of the records per the label of
+    their day, ISO week or month (`by_period`) and/or per their category
+    (`by_cat`). The records without a date are labeled ``"-"``.
+    """
+    if not by_period and not by_cat:
+        tag_counts = Counter()
+        next_day = 1
+        for rec in records:
+            while next_day<=rec.day:
+                tag_counts.update(lineparser.tag_re.findall(
+                    records.date_lines[next_day]))
+                next_day += 1
+            tag_counts.update(rec.tags)
+        for date_line in records.date_lines[next_day:]:
+            tag_counts.update(lineparser.tag_re.findall(date_line))
+        return translate(tag_counts, tag_translator)
+
+    day_labels = [rollups.period_of(day, by_period)[0] if day else "-"
+                  for day in records.day_dates()] if by_period else None
+    grouped = {}
+    for rec in records:
+        groups = rec.cats if by_cat else ("",)
+        for cat in groups:
+            label = " ".join(filter(None, (
+                day_labels[rec.day] if day_labels else "", cat)))
+            if label not in grouped:
+                grouped[label] = Counter()
+            grouped[label].update(rec.tags)
+    return {label:translate(tag_counts, tag_translator)
+            for label, tag_counts in grouped.items()}
+
+def most_common(tag_counts, top=None, min_count=1):
+    """ Returns the (tag, count) pairs from the most common on, at most `top`
+    of them and only those counted at least `min_count` times. """
+    common = [(tag, tag_count) for tag, tag_count in tag_counts.most_common()
+              if tag_count>=min_count]
+    return common[:top] if top else common
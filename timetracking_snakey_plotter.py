@@ -1,7 +1,6 @@
 from collections import defaultdict
-from plotly.offline import plot as plotlyplot
-import plotly.graph_objects as plotlygo
 from math import floor
+import json
 
 
 def _mins_to_hours(mins):
@@ -9,11 +8,103 @@ def _mins_to_hours(mins):
     remaining_minutes = int(mins-total_hours*60)
     return f"{total_hours}:{remaining_minutes:02d}"
 
-def plot_timetracking_data(data, plot_specifiers = True):
+OTHER_LABEL = "Other"
+
+def _per_level(value):
+    """Helper to accept a single threshold or one for each of the levels."""
+    if isinstance(value, (tuple, list)):
+        return tuple(value)
+    return (value, value, value)
+
+def _kept(minutes_per_label, top_k, min_minutes):
+    """Helper to select the labels that are not merged to the "Other" node."""
+    kept = [label for label, minutes in minutes_per_label.items()
+            if not min_minutes or minutes>=min_minutes]
+    if top_k is not None and len(kept)>top_k:
+        kept = sorted(kept, key=lambda l: (-minutes_per_label[l], l))[:top_k]
+    return set(kept)
+
+def build_snakey_data(data, plot_specifiers = True, top_k = None,
+                      min_minutes = 0):
+    """ Builds the nodes and the links of the snakey diagram.
+
+    The nodes are interned in dictionaries and the parallel links are
+    merged, so building stays linear in the size of the data. To keep the
+    diagram at a size a browser can render, the long tail of each level can
+    be merged to an "Other" node.
+
+    Parameters
+    ----------
+    data : `dict`
+       See `plot_timetracking_data`.
+    plot_specifiers : `bool`
+       Add the specifier tags as the third level of nodes.
+    top_k : `int` or `tuple`
+       Keep at most this many nodes (with the most minutes) per level. Can
+       also be given separately for the (category, activity, specifier)
+       levels. `None` keeps all.
+    min_minutes : `float` or `tuple`
+       Merge the nodes with less minutes than this (per level) to "Other".
+    
+    Returns
+    -------
+    A tuple (shown_labels, source_nodes, target_nodes, values) with the node
+    labels and, for each link, the indices of the source and target nodes as
+    well as the duration in minutes.
+    """
+    top_ks, min_mins = _per_level(top_k), _per_level(min_minutes)
+    cat_mins = defaultdict(float)
+    act_mins = defaultdict(float)
+    spc_mins = defaultdict(float)
+    for cat, (cat_minutes, activities) in data.items():
+        cat_mins[cat]+=cat_minutes
+        for act, (act_minutes, specifiers) in activities.items():
+            if act_minutes>0:
+                act_mins[act]+=act_minutes
+                for spc, spc_minutes in (specifiers or
+                                         {"None specified": 1}).items():
+                    spc_mins[spc]+=spc_minutes
+    kept_cats = _kept(cat_mins, top_ks[0], min_mins[0])
+    kept_acts = _kept(act_mins, top_ks[1], min_mins[1])
+    kept_spcs = _kept(spc_mins, top_ks[2], min_mins[2])
+
+    # The nodes are keyed by (level, label) as the levels may share labels
+    node_mins = defaultdict(float)
+    links = defaultdict(float)
+    for cat, (cat_minutes, activities) in data.items():
+        cat_node = (0, cat if cat in kept_cats else OTHER_LABEL)
+        node_mins[cat_node]+=cat_minutes
+        for act, (act_minutes, specifiers) in activities.items():
+            if act_minutes<=0:
+                continue
+            act_node = (1, act if act in kept_acts else OTHER_LABEL)
+            node_mins[act_node]+=act_minutes
+            links[cat_node, act_node]+=act_minutes
+            if plot_specifiers:
+                for spc, spc_minutes in (specifiers or
+                                         {"None specified": 1}).items():
+                    spc_node = (2, spc if spc in kept_spcs else OTHER_LABEL)
+                    node_mins[spc_node]+=spc_minutes
+                    links[act_node, spc_node]+=spc_minutes
+
+    # Sorted by level and by label, the "Other" node last on each level
+    nodes = sorted(node_mins, key=lambda n: (n[0], n[1]==OTHER_LABEL, n[1]))
+    node_idx = {node:i for i, node in enumerate(nodes)}
+    shown_labels = [label.replace('@', '')+" "+_mins_to_hours(node_mins[level, label])
+                    if level<2 else label
+                    for level, label in nodes]
+    source_nodes = [node_idx[src] for src, _ in links]
+    target_nodes = [node_idx[tgt] for _, tgt in links]
+    values = list(links.values())
+    return shown_labels, source_nodes, target_nodes, values
+
+def plot_timetracking_data(data, plot_specifiers = True, top_k = None,
+                           min_minutes = 0, output = None):
     """ Plots the timetracking data as a snakey diagram.
     
     Does not return anything, but shows the resulting diagram in a new browser
-    tab. Returns nothing. The plotting is done using *plotly*.
+    tab. Returns nothing. The plotting is done using *plotly*. If an `output`
+    file is given, the diagram is written there instead (headlessly).
 
     Parameters
     ----------
@@ -25,53 +116,26 @@ def plot_timetracking_data(data, plot_specifiers = True):
        On the third level there is activity specifier tag mapping:
           ``'@Blogs' : 30.0``
        All durations are given in minutes.
+    plot_specifiers, top_k, min_minutes :
+       See `build_snakey_data`.
+    output : `str`
+       Write the diagram to this file. A ``.json`` file gets the nodes and
+       the links (and needs no *plotly*), other files a self-contained HTML
+       page.
       """
-    sources = []
-    targets = []
-    values = []
-    cat_labels = []
-    act_labels = []
-    spc_labels = []
-    cat_mins = defaultdict(float) 
-    act_mins = defaultdict(float) 
-
-    for cat, cat_data in sorted(data.items()):
-        cat_minutes, activities = cat_data
-        cat_mins[cat]+=cat_minutes
-        if not cat in cat_labels: cat_labels.append(cat)
-        for act, act_data in sorted(activities.items()):
-            act_minutes, _ = act_data
-            if act_minutes>0:
-                act_mins[act]+=act_minutes
-                if not act in act_labels: act_labels.append(act)
-                sources.append(cat)
-                targets.append(act)
-                values.append(act_minutes)
-        
-        if plot_specifiers:
-            for act, act_data in sorted(activities.items()):
-                _, specifiers = act_data
-                if not specifiers:
-                    specifiers["None specified"] = 1
-                for spc, spc_minutes in sorted(specifiers.items()):
-                    spc_label = "specifier_"+spc
-                    if not spc_label in spc_labels: spc_labels.append(spc_label)
-                    sources.append(act)
-                    targets.append(spc_label)
-                    values.append(spc_minutes)
-        
-    labels = list(sorted(cat_labels)) +\
-                list(sorted(act_labels)) +\
-                list(sorted(spc_labels))
-    label_dict = {y:x for x, y in enumerate(labels)}
-    source_nodes = [label_dict[x] for x in sources]
-    target_nodes = [label_dict[x] for x in targets]
-
-    shown_labels = [cl.replace('@', '')+" "+_mins_to_hours(cat_mins[cl])
-                        for cl in sorted(cat_labels)] +\
-                    [al.replace('@', '')+" "+_mins_to_hours(act_mins[al])
-                        for al in sorted(act_labels)] +\
-                    [sl.replace('specifier_', '') for sl in list(sorted(spc_labels))]
+    shown_labels, source_nodes, target_nodes, values = \
+        build_snakey_data(data, plot_specifiers, top_k, min_minutes)
+
+    if output and output.endswith('.json'):
+        with open(output, 'w') as f:
+            json.dump({'nodes': shown_labels,
+                       'links': [{'source': s, 'target': t, 'value': v}
+                                 for s, t, v in zip(source_nodes, target_nodes,
+                                                    values)]}, f)
+        return
+
+    from plotly.offline import plot as plotlyplot
+    import plotly.graph_objects as plotlygo
 
     fig = plotlygo.Figure( data=[plotlygo.Sankey(
             node = {'label' : shown_labels},
@@ -80,6 +144,10 @@ def plot_timetracking_data(data, plot_specifiers = True):
                     'target': target_nodes,
                     'value': values})])
 
+    if output:
+        fig.write_html(output, include_plotlyjs=True)
+        return
+
     # With this save the plots 
     plotlyplot(fig,
         image_filename='sankey_plot_1', 
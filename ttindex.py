@@ -0,0 +1,367 @@
+""" A persistent SQLite index of the timetracking records.
+
+Build (or incrementally update) the index from the timetracking files:
+
+    python ttindex.py build journal/*.txt
+
+and then answer the questions straight from the index:
+
+    python ttindex.py query --cat @RES --from 2022-03-01 --to 2022-03-31
+    python ttindex.py query --tag @Meeting --days
+    python ttindex.py query --activity
+    python ttindex.py query --count_tags
+"""
+from datetime import date
+import argparse
+import os
+import sqlite3
+
+import lineparser
+import linereader
+from main import min2str
+
+# Bump this when the schema changes, the older indices are then rebuilt
+SCHEMA_VERSION = 3
+
+_tables = ('files', 'records', 'rec_cats', 'rec_acts', 'rec_spcs',
+           'day_cats', 'day_acts', 'line_tags', 'meta')
+
+# The files are ordered by `seq` (see `build_index`). The minutes of the
+#  records are split to the (category, ...) rows at build time, so that the
+#  queries are plain sums. These are also summed per file and date, so that
+#  the queries without a --tag add up only a row per day. The totals match
+#  `lineparser.summarize_records` up to the floating point rounding, as the
+#  minutes are not added in the same order.
+_schema = """
+CREATE TABLE IF NOT EXISTS files (
+    file_id INTEGER PRIMARY KEY, path TEXT UNIQUE,
+    size INTEGER, mtime_ns INTEGER, seq INTEGER);
+CREATE TABLE IF NOT EXISTS records (
+    rec_id INTEGER PRIMARY KEY, file_id INTEGER, lineno INTEGER, date TEXT,
+    start_min INTEGER, end_min INTEGER, minutes INTEGER,
+    cats TEXT, tags TEXT, and_tags TEXT, has_all INTEGER);
+CREATE INDEX IF NOT EXISTS records_file ON records(file_id);
+CREATE INDEX IF NOT EXISTS records_date ON records(date);
+-- The split weights of the records. The rows of kind 0 are for the records
+--  without the @ALL category, the kind 1 rows keep the @ALL as is (as in the
+--  by activity summaries) and in the kind 2 rows it is replaced by all the
+--  other categories (as in the totals).
+CREATE TABLE IF NOT EXISTS rec_cats (
+    rec_id INTEGER, kind INTEGER, cat TEXT, minutes REAL);
+CREATE INDEX IF NOT EXISTS rec_cats_rec ON rec_cats(rec_id);
+CREATE INDEX IF NOT EXISTS rec_cats_cat ON rec_cats(cat);
+CREATE TABLE IF NOT EXISTS rec_acts (
+    rec_id INTEGER, cat TEXT, activity TEXT, minutes REAL);
+CREATE INDEX IF NOT EXISTS rec_acts_rec ON rec_acts(rec_id);
+CREATE TABLE IF NOT EXISTS rec_spcs (
+    rec_id INTEGER, cat TEXT, activity TEXT, specifier TEXT, minutes REAL);
+-- The sums of the rec_cats and rec_acts rows per file and date
+CREATE TABLE IF NOT EXISTS day_cats (
+    file_id INTEGER, date TEXT, kind INTEGER, cat TEXT, minutes REAL);
+CREATE INDEX IF NOT EXISTS day_cats_file ON day_cats(file_id);
+CREATE INDEX IF NOT EXISTS day_cats_cat ON day_cats(kind, cat, date, minutes);
+CREATE TABLE IF NOT EXISTS day_acts (
+    file_id INTEGER, date TEXT, cat TEXT, activity TEXT, minutes REAL);
+CREATE INDEX IF NOT EXISTS day_acts_file ON day_acts(file_id);
+CREATE INDEX IF NOT EXISTS day_acts_act ON day_acts(cat, activity, date, minutes);
+CREATE INDEX IF NOT EXISTS rec_spcs_rec ON rec_spcs(rec_id);
+-- The tags of all the lines, also of those that are not records, and their
+--  position on the line
+CREATE TABLE IF NOT EXISTS line_tags (
+    file_id INTEGER, lineno INTEGER, pos INTEGER, date TEXT, tag TEXT);
+CREATE INDEX IF NOT EXISTS line_tags_file ON line_tags(file_id, lineno);
+CREATE INDEX IF NOT EXISTS line_tags_tag ON line_tags(tag);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+def open_index(index_path):
+    """ Opens the index, (re)creating it if it is missing or outdated. """
+    conn = sqlite3.connect(index_path)
+    try:
+        row = conn.execute(
+            "SELECT value FROM meta WHERE key='schema_version'").fetchone()
+    except sqlite3.OperationalError:
+        row = None
+    if row is None or row[0]!=str(SCHEMA_VERSION):
+        with conn:
+            for table in _tables:
+                conn.execute(f"DROP TABLE IF EXISTS {table}")
+    conn.executescript(_schema)
+    with conn:
+        conn.execute("INSERT OR REPLACE INTO meta VALUES ('schema_version', ?)",
+                     (str(SCHEMA_VERSION),))
+    return conn
+
+def _counts(tags):
+    """ Helper to count the occurrences of each (distinct) tag. """
+    counts = {}
+    for tag in tags:
+        counts[tag] = counts.get(tag, 0)+1
+    return counts
+
+def _remove_file(conn, file_id):
+    for table in ('rec_cats', 'rec_acts', 'rec_spcs'):
+        conn.execute(f"DELETE FROM {table} WHERE rec_id IN "
+                     "(SELECT rec_id FROM records WHERE file_id=?)", (file_id,))
+    for table in ('records', 'day_cats', 'day_acts'):
+        conn.execute(f"DELETE FROM {table} WHERE file_id=?", (file_id,))
+    conn.execute("DELETE FROM line_tags WHERE file_id=?", (file_id,))
+    conn.execute("DELETE FROM files WHERE file_id=?", (file_id,))
+
+def _index_file(conn, file_name, st, seq):
+    cur = conn.execute("INSERT INTO files (path, size, mtime_ns, seq) "
+                       "VALUES (?,?,?,?)", (os.path.abspath(file_name),
+                                            st.st_size, st.st_mtime_ns, seq))
+    file_id = cur.lastrowid
+
+    records = lineparser.RecordTable()
+    line_tags = []
+    with linereader.open_journal(file_name) as f:
+        lines = f.readlines()
+    records.parse(lines, file_name)
+
+    day_dates = [d.isoformat() if d else None for d in records.day_dates()]
+    day = 0
+    for lineno, line in enumerate(lines, 1):
+        if lineparser.is_date_line(line):
+            day += 1
+        for pos, tag in enumerate(lineparser.tag_re.findall(line)):
+            line_tags.append((file_id, lineno, pos, day_dates[day], tag))
+    conn.executemany("INSERT INTO line_tags VALUES (?,?,?,?,?)", line_tags)
+
+    for rec in records:
+        cur = conn.execute("INSERT INTO records (file_id, lineno, date, "
+            "start_min, end_min, minutes, cats, tags, and_tags, has_all) "
+            "VALUES (?,?,?,?,?,?,?,?,?,?)",
+            (file_id, rec.lineno, day_dates[rec.day], rec.start, rec.end,
+             rec.end-rec.start, " ".join(rec.cats), " ".join(rec.tags),
+             " ".join(rec.and_tags), '@ALL' in rec.cats))
+        rec_id = cur.lastrowid
+        minutes = float(rec.end-rec.start)
+        cats = list(rec.cats)
+        kind = 1 if '@ALL' in cats else 0
+        conn.executemany("INSERT INTO rec_cats VALUES (?,?,?,?)",
+            [(rec_id, kind, cat, count*minutes/len(cats))
+             for cat, count in _counts(cats).items()])
+
+        activity_tags, specifier_tags = lineparser.split_tags(cats, rec.tags,
+                                                              rec.and_tags)
+        act_counts = _counts((cat, act) for cat in cats
+                             for act in activity_tags)
+        spc_counts = _counts((cat, act, spc) for cat in cats
+                             for act in activity_tags
+                             for spc in specifier_tags)
+        conn.executemany("INSERT INTO rec_acts VALUES (?,?,?,?)",
+            [(rec_id,)+key+(count*minutes/len(cats)/len(activity_tags),)
+             for key, count in act_counts.items()])
+        conn.executemany("INSERT INTO rec_spcs VALUES (?,?,?,?,?)",
+            [(rec_id,)+key+(count*minutes/len(cats)/len(activity_tags)/
+                            len(specifier_tags),)
+             for key, count in spc_counts.items()])
+
+    conn.execute("INSERT INTO day_cats SELECT r.file_id, r.date, c.kind, "
+        "c.cat, SUM(c.minutes) FROM rec_cats c JOIN records r USING (rec_id) "
+        "WHERE r.file_id=? GROUP BY r.date, c.kind, c.cat", (file_id,))
+    conn.execute("INSERT INTO day_acts SELECT r.file_id, r.date, c.cat, "
+        "c.activity, SUM(c.minutes) FROM rec_acts c JOIN records r "
+        "USING (rec_id) WHERE r.file_id=? GROUP BY r.date, c.cat, c.activity",
+        (file_id,))
+
+def _update_all_tag_weights(conn):
+    """ Helper to (re)compute the kind 2 rows of the @ALL records, as the set
+    of the other categories may have changed. """
+    all_cats = set()
+    for (cats,) in conn.execute("SELECT DISTINCT cats FROM records"):
+        all_cats.update(cats.split())
+    all_cats.discard('@ALL')
+    replacement = " ".join(sorted(all_cats))
+    row = conn.execute("SELECT value FROM meta WHERE key='all_tags_replacement'"
+                       ).fetchone()
+    missing = conn.execute("SELECT COUNT(*) FROM records WHERE has_all AND "
+        "rec_id NOT IN (SELECT rec_id FROM rec_cats WHERE kind=2)").fetchone()[0]
+    if row and row[0]==replacement and not missing:
+        return
+
+    conn.execute("DELETE FROM rec_cats WHERE kind=2")
+    conn.execute("DELETE FROM day_cats WHERE kind=2")
+    rows = []
+    for rec_id, cats, minutes in conn.execute(
+            "SELECT rec_id, cats, minutes FROM records WHERE has_all"
+            ).fetchall():
+        cats = lineparser.replace_all_tag(cats.split(), replacement.split())
+        rows += [(rec_id, 2, cat, count*float(minutes)/len(cats))
+                 for cat, count in _counts(cats).items()]
+    conn.executemany("INSERT INTO rec_cats VALUES (?,?,?,?)", rows)
+    conn.execute("INSERT INTO day_cats SELECT r.file_id, r.date, 2, c.cat, "
+        "SUM(c.minutes) FROM rec_cats c JOIN records r USING (rec_id) "
+        "WHERE c.kind=2 GROUP BY r.file_id, r.date, c.cat")
+    conn.execute("INSERT OR REPLACE INTO meta VALUES ('all_tags_replacement', ?)",
+                 (replacement,))
+
+def build_index(conn, file_names):
+    """ Adds the new and changed files to the index and removes the ones
+    that no longer exist. Returns the number of (re)indexed files.
+
+    The files are ordered as given, as the ties of the tag counts depend on
+    the order. The indexed files that are left out of this build keep their
+    order before the given ones. Note that the records before the first date
+    line of a file are indexed without a date.
+    """
+    indexed = {path:(file_id, size, mtime_ns, seq)
+               for file_id, path, size, mtime_ns, seq in conn.execute(
+                   "SELECT file_id, path, size, mtime_ns, seq FROM files")}
+    file_names = list(linereader.expand_file_names(file_names))
+    paths = {os.path.abspath(fn) for fn in file_names}
+    n_indexed = 0
+    with conn:
+        first_seq = 0
+        for path, (file_id, _, _, seq) in indexed.items():
+            if not os.path.exists(path):
+                _remove_file(conn, file_id)
+            elif path not in paths:
+                first_seq = max(first_seq, seq+1)
+        for seq, fn in enumerate(file_names, first_seq):
+            st = os.stat(fn)
+            path = os.path.abspath(fn)
+            if path in indexed:
+                file_id, size, mtime_ns, _ = indexed[path]
+                if size==st.st_size and mtime_ns==st.st_mtime_ns:
+                    conn.execute("UPDATE files SET seq=? WHERE file_id=?",
+                                 (seq, file_id))
+                    continue
+                _remove_file(conn, file_id)
+            _index_file(conn, fn, st, seq)
+            n_indexed += 1
+        _update_all_tag_weights(conn)
+    return n_indexed
+
+def _record_conditions(date_from=None, date_to=None, tag=None, dated='r'):
+    """ Helper to build the WHERE clause for the records (as `r`). The dates
+    are compared on the table `dated`. """
+    conditions, params = ["1"], []
+    if date_from:
+        conditions.append(f"{dated}.date>=?")
+        params.append(date_from)
+    if date_to:
+        conditions.append(f"{dated}.date<=?")
+        params.append(date_to)
+    if tag:
+        conditions.append("EXISTS (SELECT 1 FROM line_tags t WHERE "
+            "t.file_id=r.file_id AND t.lineno=r.lineno AND t.tag=?)")
+        params.append(tag)
+    return " AND ".join(conditions), params
+
+def _split_minutes(table, date_from=None, date_to=None, tag=None):
+    """ Helper to select the split minutes (as `c`) of the rec_`table` rows,
+    or of their sums per day unless the records are filtered by the `tag`.
+    Returns the FROM and the WHERE clauses and the parameters. """
+    if tag:
+        return (f"rec_{table} c JOIN records r USING (rec_id)",)+\
+            _record_conditions(date_from, date_to, tag)
+    return (f"day_{table} c",)+_record_conditions(date_from, date_to,
+                                                  dated='c')
+
+def query_totals(conn, cat=None, date_from=None, date_to=None, tag=None):
+    """ Returns the total minutes per category (with the @ALL replaced). """
+    source, where, params = _split_minutes('cats', date_from, date_to, tag)
+    if cat:
+        where += " AND c.cat=?"
+        params.append(cat)
+    return dict(conn.execute(f"SELECT c.cat, SUM(c.minutes) FROM {source} "
+        f"WHERE c.kind IN (0, 2) AND {where} GROUP BY c.cat ORDER BY c.cat",
+        params).fetchall())
+
+def query_days(conn, cat=None, date_from=None, date_to=None, tag=None):
+    """ Returns (date, minutes) of the days with matching records. """
+    if cat:
+        source, where, params = _split_minutes('cats', date_from, date_to,
+                                               tag)
+        dated = 'r' if tag else 'c'
+        return conn.execute(f"SELECT {dated}.date, SUM(c.minutes) "
+            f"FROM {source} WHERE c.kind IN (0, 2) AND c.cat=? AND {where} "
+            f"GROUP BY {dated}.date ORDER BY {dated}.date",
+            [cat]+params).fetchall()
+    where, params = _record_conditions(date_from, date_to, tag)
+    return conn.execute("SELECT r.date, SUM(r.minutes) FROM records r "
+        f"WHERE {where} GROUP BY r.date ORDER BY r.date", params).fetchall()
+
+def query_activities(conn, cat=None, date_from=None, date_to=None, tag=None):
+    """ Returns a {cat: [minutes, {activity: minutes}]} dictionary like the
+    `lineparser.summarize_records` with `also_tags` (but without the
+    specifiers). """
+    cat_where, cat_params = "", []
+    if cat:
+        cat_where = " AND c.cat=?"
+        cat_params = [cat]
+    result = {}
+    source, where, params = _split_minutes('cats', date_from, date_to, tag)
+    for c, minutes in conn.execute(f"SELECT c.cat, SUM(c.minutes) "
+            f"FROM {source} WHERE c.kind IN (0, 1) AND {where}{cat_where} "
+            "GROUP BY c.cat", params+cat_params):
+        result[c] = [minutes, {}]
+    source, where, params = _split_minutes('acts', date_from, date_to, tag)
+    for c, act, minutes in conn.execute("SELECT c.cat, c.activity, "
+            f"SUM(c.minutes) FROM {source} WHERE {where}{cat_where} "
+            "GROUP BY c.cat, c.activity", params+cat_params):
+        result[c][1][act] = minutes
+    return result
+
+def query_tag_counts(conn, date_from=None, date_to=None):
+    """ Returns (tag, count) pairs as `--count_tags` would count them. The
+    ties are in the order of the first appearance in the files. """
+    where, params = _record_conditions(date_from, date_to)
+    return conn.execute("SELECT r.tag, COUNT(*) "
+        "FROM line_tags r JOIN files f USING (file_id) "
+        f"WHERE {where} GROUP BY r.tag "
+        "ORDER BY COUNT(*) DESC, MIN(f.seq*(1<<40)+r.lineno*(1<<12)+r.pos)",
+        params).fetchall()
+
+if __name__=='__main__':
+    argparser = argparse.ArgumentParser(description=
+        'Builds and queries a persistent index of the timetracking records.')
+    argparser.add_argument("--index", dest='index_path', default="ttindex.sqlite", help="The index file")
+    subparsers = argparser.add_subparsers(dest='command', required=True)
+    build_parser = subparsers.add_parser('build', help="Add the new and changed files to the index")
+    build_parser.add_argument("file_name", nargs='+')
+    query_parser = subparsers.add_parser('query', help="Answer a query from the index")
+    query_parser.add_argument("--cat", dest='cat', help="Only show this category/project")
+    query_parser.add_argument("--tag", dest='tag', help="Only consider records with this tag")
+    query_parser.add_argument("--from", dest='date_from', type=date.fromisoformat, help="The first date to consider (YYYY-MM-DD)")
+    query_parser.add_argument("--to", dest='date_to', type=date.fromisoformat, help="The last date to consider (YYYY-MM-DD)")
+    query_parser.add_argument("--days", dest='by_day', action='store_true', help="Show the hours per day")
+    query_parser.add_argument("--activity", dest='by_activity', action='store_true', help="Show by activity")
+    query_parser.add_argument("--count_tags", dest='count_tags', action='store_true', help="Only show tags and their counts")
+    args = argparser.parse_args()
+
+    conn = open_index(args.index_path)
+    if args.command=='query':
+        date_from = args.date_from and args.date_from.isoformat()
+        date_to = args.date_to and args.date_to.isoformat()
+    if args.command=='build':
+        n_indexed = build_index(conn, args.file_name)
+        print("Indexed", n_indexed, "files")
+    elif args.count_tags:
+        for tag, tag_count in query_tag_counts(conn, date_from, date_to):
+            print(tag_count, tag)
+    elif args.by_day:
+        for day, minutes in query_days(conn, args.cat, date_from, date_to,
+                                       args.tag):
+            print(day, ":", min2str(minutes))
+    elif args.by_activity:
+        print("BY ACTIVITY:")
+        activities = query_activities(conn, args.cat, date_from,
+                                      date_to, args.tag)
+        for cat, (cat_minutes, acts) in sorted(activities.items()):
+            print("CAT", cat, min2str(int(cat_minutes)))
+            for act, act_minutes in sorted(acts.items()):
+                if act_minutes>0:
+                    percentage = act_minutes/cat_minutes*100
+                    print(f"  {act} {min2str(int(act_minutes))} ({percentage:.1f}%)")
+    else:
+        print("TOTAL:")
+        tot_tot_mins = 0
+        for cat, cat_minutes in query_totals(conn, args.cat, date_from,
+                                             date_to, args.tag).items():
+            print(cat, min2str(int(cat_minutes)))
+            tot_tot_mins+=cat_minutes
+        print("TOTALTOTAL:", min2str(int(tot_tot_mins)))
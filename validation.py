@@ -0,0 +1,92 @@
+from collections import Counter
+from heapq import heappop, heappush
+from itertools import repeat
+
+# The kinds of the issues in the report of `validate_records`
+OVERLAP, DUPLICATE, NEGATIVE_SPAN, GAP = \
+    'overlap', 'duplicate', 'negative_span', 'gap'
+
+def _location(rec, line):
+    return {'source': rec.source, 'lineno': rec.lineno, 'line': line}
+
+def _sections(records, lines):
+    """ Helper to group the records by their calendar date, so that the
+    records of the same date in different files (or in repeated date
+    sections) are checked together. The records without a (valid) date are
+    grouped by their file and date section instead. """
+    day_dates = records.day_dates()
+    sections = {}
+    for rec, line in zip(records, lines):
+        day = day_dates[rec.day]
+        key = (day.isoformat(),) if day is not None else \
+            (None, rec.source, rec.day)
+        sections.setdefault(key, []).append((rec, line.strip()))
+    return sections
+
+def validate_records(records, min_gap=None, lines=None):
+    """ Checks all the intervals of each date of a `lineparser.RecordTable`.
+    The `lines` of the records (see `linereader.record_lines`) are quoted in
+    the locations and tell the duplicates apart.
+
+    The intervals of a date are sorted by their start and swept once while
+    keeping a heap (by the end) of the intervals that have not ended yet.
+    Each record is compared with all of these, so that all the overlapping
+    pairs are found also between non-adjacent lines and across the files in
+    O(n log n + k) for k issues. The reported issues are:
+     * ``overlap`` the record starts before an earlier one has ended
+     * ``duplicate`` the record has the same times and text as an earlier
+       one on the same date, e.g., a day section pasted to two files
+     * ``negative_span`` the record ends before it starts, e.g., it crosses
+       the midnight. These are left out of the sweep.
+     * ``gap`` there is no record for at least `min_gap` minutes between the
+       records of the date (only if `min_gap` is given)
+
+    Returns a JSON serializable dictionary with the list of the ``issues``
+    (each with the ``date``, ``minutes`` and the file and line
+    ``locations``) and their ``counts``.
+    """
+    issues = []
+    if lines is None:
+        lines = repeat("")
+    for key, section in _sections(records, lines).items():
+        day = key[0]
+        spans = []
+        for rec, line in section:
+            if rec.end<rec.start:
+                issues.append({'kind':NEGATIVE_SPAN, 'date':day,
+                               'minutes':rec.end-rec.start,
+                               'locations':[_location(rec, line)]})
+            else:
+                spans.append((rec, line))
+        spans.sort(key=lambda span: (span[0].start, span[0].end))
+
+        active, latest = [], None
+        for i, (rec, line) in enumerate(spans):
+            while active and active[0][0]<=rec.start:
+                heappop(active)
+            if (not active and latest is not None and min_gap is not None
+                    and rec.start-latest.end>=min_gap):
+                issues.append({'kind':GAP, 'date':day,
+                               'minutes':rec.start-latest.end,
+                               'locations':[_location(latest, latest_line),
+                                            _location(rec, line)]})
+            for _, _, other, other_line in sorted(active,
+                                                  key=lambda a: a[1]):
+                is_duplicate = (rec.start==other.start and
+                                rec.end==other.end and line==other_line)
+                issues.append({
+                    'kind':DUPLICATE if is_duplicate else OVERLAP,
+                    'date':day,
+                    'minutes':min(rec.end, other.end)-rec.start,
+                    'locations':[_location(other, other_line),
+                                 _location(rec, line)]})
+            heappush(active, (rec.end, i, rec, line))
+            if latest is None or rec.end>latest.end:
+                latest, latest_line = rec, line
+
+    issues.sort(key=lambda issue: (issue['date'] is None,
+                                   issue['date'] or "",
+                                   issue['locations'][0]['source'],
+                                   issue['locations'][0]['lineno']))
+    return {'issues':issues,
+            'counts':dict(Counter(issue['kind'] for issue in issues))}
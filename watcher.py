@@ -0,0 +1,274 @@
+from socketserver import StreamRequestHandler, ThreadingTCPServer
+from threading import Lock, Thread
+from datetime import datetime
+from hashlib import sha1
+import io
+import json
+import os
+import time
+
+import lineparser
+import linereader
+
+def _hash_prefix(f, size):
+    """ Helper to hash the first `size` bytes of the binary file. Returns
+    the `hashlib.sha1` object to continue the hash from. """
+    content_hash = sha1()
+    while size>0:
+        block = f.read(min(1<<20, size))
+        if not block:
+            break
+        content_hash.update(block)
+        size -= len(block)
+    return content_hash
+
+def _text_lines(data):
+    return io.TextIOWrapper(io.BytesIO(data)).readlines()
+
+class _WatchedFile:
+    """ The parsed records and the partial totals of one watched file. """
+    def __init__(self):
+        self.size, self.mtime_ns = -1, -1
+        self.hash = None
+        self.ends_with_newline = False
+        self.n_lines = 0
+        self.records = lineparser.RecordTable()
+        self.cats = set()
+        self.totals = {}
+        self.day_totals = {}
+
+class JournalWatcher:
+    """ Keeps the per-category and per-day totals of the files up to date.
+
+    On each `poll` the file names are globbed again (to notice new day
+    files) and only the changed files are read. If a file has only grown,
+    just the appended lines are parsed and their totals added, so the cost
+    of an update depends on the size of the edit, not on the size of the
+    archive.
+
+    Parameters
+    ----------
+    file_names : `list`
+       The file names, possibly with wildcards.
+    only_cat : `str`
+       Only durations for this category tag are calculated.
+    record_filter : `callable`
+       Optional function that takes a `lineparser.RecordTable` and returns
+       it filtered.
+
+    A file that cannot be read or parsed (e.g., a half typed line) keeps
+    its last good totals and its error is kept in `errors` until the file
+    is read successfully again.
+    """
+    def __init__(self, file_names, only_cat=None, record_filter=None):
+        self.file_names = file_names
+        self.only_cat = only_cat
+        self.record_filter = record_filter
+        self.files = {}
+        self.errors = {}
+        self._failed = {}
+        self.all_tags_replacement = []
+        self.updated = None
+        self.lock = Lock()
+
+    def _summarize(self, wf, records):
+        if self.record_filter:
+            records = self.record_filter(records)
+        totals = lineparser.summarize_records(records, self.only_cat,
+            all_tags_replacement=self.all_tags_replacement, do_print=False)
+        for cat, minutes in totals.items():
+            wf.totals[cat] = wf.totals.get(cat, 0)+minutes
+        day_dates = records.day_dates()
+        for rec in records:
+            minutes = rec.end-rec.start
+            if self.only_cat:
+                # The share of the category, as in the totals
+                cats = lineparser.replace_all_tag(rec.cats,
+                                                  self.all_tags_replacement)
+                if not cats:
+                    continue
+                minutes = cats.count(self.only_cat)*minutes/len(cats)
+                if not minutes:
+                    continue
+            day = day_dates[rec.day]
+            wf.day_totals[day] = wf.day_totals.get(day, 0)+minutes
+
+    def _resummarize(self, wf):
+        wf.totals, wf.day_totals = {}, {}
+        self._summarize(wf, wf.records)
+
+    def _read(self, fn, wf, st):
+        """ Helper to parse the (changed part of the) file. Returns the
+        table of the new records or `None` if the whole file was parsed.
+        The file has only been appended to if the hash of its old content
+        still matches. The `wf` is left as is if the parsing fails. """
+        tail = None
+        if (st.st_size>wf.size>=0 and wf.ends_with_newline and
+                not linereader.is_compressed(fn)):
+            with open(fn, 'rb') as f:
+                content_hash = _hash_prefix(f, wf.size)
+                if content_hash.hexdigest()==wf.hash:
+                    tail = f.read()
+
+        if tail is not None:
+            content_hash.update(tail)
+            tail_lines = _text_lines(tail)
+            new_table = lineparser.RecordTable().parse(tail_lines, fn,
+                                                       wf.n_lines+1)
+            first_new = len(wf.records)
+            wf.records.extend(new_table)
+            new_records = wf.records.subset(range(first_new,
+                                                  len(wf.records)))
+            wf.n_lines += len(tail_lines)
+            wf.size += len(tail)
+            wf.ends_with_newline = tail.endswith(b"\n")
+        else:
+            if linereader.is_compressed(fn):
+                with linereader.open_journal(fn) as f:
+                    lines = f.readlines()
+                content_hash, data = None, b""
+            else:
+                with open(fn, 'rb') as f:
+                    data = f.read()
+                content_hash, lines = sha1(data), _text_lines(data)
+            records = lineparser.RecordTable().parse(lines, fn)
+            wf.records, wf.n_lines = records, len(lines)
+            wf.size = len(data) if content_hash else st.st_size
+            wf.ends_with_newline = data.endswith(b"\n")
+            new_records = None
+
+        wf.mtime_ns = st.st_mtime_ns
+        wf.hash = content_hash.hexdigest() if content_hash else None
+        return new_records
+
+    def poll(self):
+        """ Reads the changes of the files. Returns `True` if anything
+        changed (or a file failed to be read) since the last poll. """
+        changed = {}
+        seen = set()
+        new_errors = False
+        for fn in linereader.expand_file_names(self.file_names):
+            seen.add(fn)
+            try:
+                st = os.stat(fn)
+            except OSError:
+                continue
+            wf = self.files.get(fn) or _WatchedFile()
+            if (st.st_size==wf.size and st.st_mtime_ns==wf.mtime_ns or
+                    self._failed.get(fn)==(st.st_size, st.st_mtime_ns)):
+                continue
+            try:
+                changed[fn] = (wf, self._read(fn, wf, st))
+            except (OSError, ValueError) as e:
+                self._failed[fn] = (st.st_size, st.st_mtime_ns)
+                self.errors[fn] = str(e)
+                new_errors = True
+                continue
+            self._failed.pop(fn, None)
+            self.errors.pop(fn, None)
+        removed = [fn for fn in self.files if fn not in seen]
+        for fn in set(self.errors)-seen:
+            del self.errors[fn]
+            self._failed.pop(fn, None)
+        if not changed and not removed:
+            return new_errors
+
+        with self.lock:
+            for fn in removed:
+                del self.files[fn]
+            for fn, (wf, new_records) in changed.items():
+                self.files[fn] = wf
+                wf.cats = wf.records.categories()
+
+            all_cats = set().union(*(wf.cats for wf in self.files.values()))
+            all_tags_replacement = []
+            if '@ALL' in all_cats:
+                all_cats.remove('@ALL')
+                all_tags_replacement = sorted(all_cats)
+
+            if all_tags_replacement!=self.all_tags_replacement:
+                # The @ALL replacement changes the totals of all files
+                self.all_tags_replacement = all_tags_replacement
+                for wf in self.files.values():
+                    self._resummarize(wf)
+            else:
+                for wf, new_records in changed.values():
+                    if new_records is None:
+                        self._resummarize(wf)
+                    else:
+                        self._summarize(wf, new_records)
+            self.updated = datetime.now()
+        return True
+
+    def totals(self):
+        """ Returns the total minutes per category. """
+        with self.lock:
+            totals = {}
+            for wf in self.files.values():
+                for cat, minutes in wf.totals.items():
+                    totals[cat] = totals.get(cat, 0)+minutes
+            return totals
+
+    def day_totals(self):
+        """ Returns the total minutes per `datetime.date` (`None` for the
+        records before the first date line of a file). """
+        with self.lock:
+            day_totals = {}
+            for wf in self.files.values():
+                for day, minutes in wf.day_totals.items():
+                    day_totals[day] = day_totals.get(day, 0)+minutes
+            return day_totals
+
+    def snapshot(self):
+        """ Returns the current totals as a JSON serializable dictionary. """
+        day_totals = self.day_totals()
+        return {
+            'updated': self.updated.isoformat() if self.updated else None,
+            'errors': dict(self.errors),
+            'totals': self.totals(),
+            'days': {day.isoformat():day_totals[day]
+                     for day in sorted(day for day in day_totals
+                                       if day is not None)}}
+
+class _SnapshotHandler(StreamRequestHandler):
+    def handle(self):
+        self.wfile.write(json.dumps(self.server.watcher.snapshot()).encode()
+                         + b"\n")
+
+class _SnapshotServer(ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+def serve_snapshots(watcher, port, host="127.0.0.1"):
+    """ Starts a background server that replies with the current
+    `JournalWatcher.snapshot` as JSON to each connection, e.g., to be read
+    with ``nc localhost PORT``. """
+    server = _SnapshotServer((host, port), _SnapshotHandler)
+    server.watcher = watcher
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def print_summary(watcher, min2str, n_days=7):
+    """ Prints the totals of the last `n_days` days and per category. """
+    if watcher.updated:
+        print("--- Updated", watcher.updated.strftime("%H:%M:%S"), "---")
+    for fn, error in sorted(watcher.errors.items()):
+        print("ERROR: Keeping the last totals of", fn, "until fixed:", error)
+    day_totals = watcher.day_totals()
+    days = sorted(day for day in day_totals if day is not None)
+    for day in days[-n_days:]:
+        print(day.isoformat(), ":", min2str(day_totals[day]))
+    print("TOTAL:")
+    tot_tot_mins = 0
+    for cat, cat_minutes in sorted(watcher.totals().items()):
+        print(cat, min2str(int(cat_minutes)))
+        tot_tot_mins+=cat_minutes
+    print("TOTALTOTAL:", min2str(int(tot_tot_mins)))
+    print(flush=True)
+
+def watch(watcher, min2str, interval=1.0):
+    """ Polls the files forever and prints the summary on each change. """
+    while True:
+        if watcher.poll():
+            print_summary(watcher, min2str)
+        time.sleep(interval)